@@ -0,0 +1,79 @@
+"""Benchmark comparing the mapping of reference sequences to AlphaFold structures
+computed by pairwise2.align.globalxx (the original implementation) and by reference_db._get_mapping.
+
+It uses reference sequences from the SQLite database and the downloaded pdb files."""
+
+import sqlite3
+import time
+from sys import stdout
+
+from tqdm import tqdm
+
+import config
+from reference_db import _get_mapping, _get_pdb_sequence
+
+
+def get_mapping_pairwise2(reference_sequence, pdb_sequence):
+    from Bio import pairwise2
+
+    alignment = pairwise2.align.globalxx(reference_sequence, pdb_sequence)[0]
+
+    mapping = []
+    i = 0
+    for reference_element, pdb_element in zip(alignment[0], alignment[1]):
+        if reference_element == '-':
+            if pdb_element != '-':
+                i += 1
+        else:
+            if pdb_element == '-':
+                mapping.append(-1)
+            else:
+                mapping.append(i)
+                i += 1
+    return mapping
+
+
+def _count_matches(reference_sequence, pdb_sequence, mapping):
+    return sum(1 for (i, j) in enumerate(mapping) if j != -1 and reference_sequence[i] == pdb_sequence[j])
+
+
+def main() -> None:
+    db_connection = sqlite3.connect(config.database_path)
+    cursor = db_connection.cursor()
+    cursor.execute("SELECT uniprot_id, protein_sequence FROM mtmod_proteins ORDER BY uniprot_id")
+    pairs = []
+    for uniprot_id, reference_sequence in cursor.fetchall():
+        pdb_sequence = _get_pdb_sequence(uniprot_id)
+        if pdb_sequence is not None:
+            pairs.append((uniprot_id, reference_sequence, str(pdb_sequence)))
+    db_connection.close()
+
+    times = {'pairwise2': 0.0, 'new': 0.0}
+    identical = 0
+    same_score = 0
+    for uniprot_id, reference_sequence, pdb_sequence in tqdm(pairs, desc='Mapping proteins', file=stdout):
+        start = time.perf_counter()
+        old_mapping = get_mapping_pairwise2(reference_sequence, pdb_sequence)
+        times['pairwise2'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        new_mapping = _get_mapping(reference_sequence, pdb_sequence)
+        times['new'] += time.perf_counter() - start
+
+        if old_mapping == new_mapping:
+            identical += 1
+        # different optimal alignments may be chosen, but they must have the same number of matches
+        if (_count_matches(reference_sequence, pdb_sequence, old_mapping)
+                == _count_matches(reference_sequence, pdb_sequence, new_mapping)):
+            same_score += 1
+        else:
+            print(f'Mappings of protein {uniprot_id} have different number of matches')
+
+    print(f'Proteins with structure: {len(pairs)}')
+    print(f'pairwise2 mapping: {times["pairwise2"]:.2f} s')
+    print(f'new mapping: {times["new"]:.2f} s')
+    print(f'Identical mappings: {identical}, mappings with the same number of matches: {same_score}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark comparing the rendering of annotated protein sequences by the original
+per-character template loop and by html_builder.render_sequence_html.
+
+It uses the longest proteins of the SQLite database and synthetic proteins
+of growing length with a modification at every 5th residue to show the scaling."""
+
+import random
+import time
+
+import jinja2
+import pandas as pd
+
+import config
+from db_access import get_protein_info, get_modifications_with_sources
+from html_builder import render_sequence_html
+
+# the per-character loop of the original protein_page.html
+OLD_TEMPLATE = """{% autoescape false %}
+{% for c in single_chars -%}
+{% if loop.index0 % 50 == 49 -%}{{ c }} <br/>{% elif loop.index0 % 10 == 9%}{{ c }} {% else %}{{ c }}{%- endif %}
+{%- endfor %}
+{% endautoescape %}"""
+
+
+def render_sequence_html_old(sequence, modifications, modification_df, template):
+    """The original implementation: a list of characters and positions.count for each modification"""
+    multiple = {}
+    positions2d = []
+    positions = [mod[0] - 1 for mod in modifications]
+    for pos, pos_type, *_ in modifications:
+        pos -= 1
+        if positions.count(pos) > 1:
+            multiple.setdefault(pos, []).append(pos_type)
+            pos_type = "multiple"
+        positions2d.append((pos, pos_type))
+
+    single_chars = list(sequence)
+    for pos, pos_type in positions2d:
+        modification_type = pos_type
+        if pos in multiple:
+            modification_type = " ".join(multiple[pos])
+        single_chars[pos] = (
+            f'<a href="#source{pos + 1}_1" data-bs-toggle="tooltip" data-bs-placement="top" title="{pos + 1}, {modification_type}">'
+            f'<span style="color: {modification_df.loc[pos_type, "Text_color"]}; '
+            f'background-color:{modification_df.loc[pos_type, "Color"]}">'
+            f'{sequence[pos]}</span></a>'
+        )
+    return template.render(single_chars=single_chars)
+
+
+def _time(function, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _get_sites(modifications):
+    """Sites for render_sequence_html from modifications sorted by position"""
+    sites = []
+    for pos, pos_type, *_ in modifications:
+        if sites and sites[-1][0] == pos - 1:
+            sites[-1] = (pos - 1, "multiple", f"{sites[-1][2]} {pos_type}")
+        else:
+            sites.append((pos - 1, pos_type, pos_type))
+    return sites
+
+
+def main() -> None:
+    modification_df = pd.read_csv(config.modifications_csv_path, index_col="Code")
+    template = jinja2.Environment().from_string(OLD_TEMPLATE)
+
+    protein_info = get_protein_info()
+    modifications = get_modifications_with_sources()
+    longest = sorted(protein_info.values(), key=lambda x: len(x["protein_sequence"]), reverse=True)[:10]
+    print("Longest proteins of the database:")
+    for info in longest:
+        protein_modifications = modifications.get(info["uniprot_id"], [])
+        sequence = info["protein_sequence"]
+        old = _time(render_sequence_html_old, sequence, protein_modifications, modification_df, template)
+        new = _time(render_sequence_html, sequence, _get_sites(protein_modifications), modification_df)
+        print(f'{info["uniprot_id"]}: {len(sequence)} residues, {len(protein_modifications)} modifications, '
+              f'old {old * 1000:.2f} ms, new {new * 1000:.2f} ms')
+
+    print("Synthetic proteins with a modification at every 5th residue:")
+    types = [code for code in modification_df.index if code != "multiple"]
+    rng = random.Random(0)
+    for length in [1000, 2000, 4000, 8000, 16000, 32000]:
+        sequence = "".join(rng.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(length))
+        synthetic_modifications = [(pos, rng.choice(types)) for pos in range(1, length + 1, 5)]
+        sites = _get_sites(synthetic_modifications)
+        old = _time(render_sequence_html_old, sequence, synthetic_modifications, modification_df, template)
+        new = _time(render_sequence_html, sequence, sites, modification_df)
+        print(f'{length} residues, {len(sites)} modifications: old {old * 1000:.2f} ms, new {new * 1000:.2f} ms, '
+              f'new per residue {new / length * 1e9:.0f} ns')
+
+
+if __name__ == "__main__":
+    main()
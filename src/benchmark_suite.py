@@ -0,0 +1,294 @@
+"""Benchmark suite timing the stages of excel_parser.py and html_builder.py offline on synthetic data.
+
+For each requested scale a data set is generated by synthetic_proteome.py (and reused by later
+runs with the same parameters). The pipeline then runs on it from scratch, without network access:
+building the reference index, excel_parser.py with its own stages, reading pdb sequences and
+mapping them by reference_db._get_mapping, the search index and the protein table of the main
+pages, and the protein pages of html_builder.py for a sample of proteins, with the PyMOL export
+of their structures if PyMOL is installed.
+
+Results are saved to config.benchmark_results_dir in a JSON file named by the git commit,
+so that a later run can be compared with the results of an older commit by --compare.
+
+Usage: python3 benchmark_suite.py [--proteins 1000 10000] [--site-density 0.01] [--pages 200]
+                                  [-j 4] [--repeat 3] [--compare HEAD~1]"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import config
+import synthetic_proteome
+
+# ratio of times above which a stage is reported as slower than in the compared results
+SLOWER_RATIO = 1.1
+
+
+def _configure(data_dir: str) -> None:
+    """Point all paths of config to the data set in data_dir and its outputs"""
+    for (name, path) in synthetic_proteome.PATHS.items():
+        setattr(config, name, os.path.join(data_dir, path))
+    config.excel_cache_dir = os.path.join(data_dir, 'cache/')
+    config.database_path = os.path.join(data_dir, 'ymtptm.db')
+    config.reference_index_path = os.path.join(data_dir, 'reference_index.db')
+    config.build_report_dir = os.path.join(data_dir, 'reports/')
+    config.web_output_dir = os.path.join(data_dir, 'web')
+    config.build_manifest_path = os.path.join(data_dir, 'web', 'build_manifest.json')
+    config.structure_cache_path = os.path.join(data_dir, 'structure_cache.db')
+    config.neighborhood_cache_path = os.path.join(data_dir, 'neighborhoods.db')
+    # all structures exist, so nothing is downloaded; a download would fail right away
+    config.alphafold_pdb_url = 'http://127.0.0.1:9/{uniprot_id}.pdb'
+
+
+def _remove_outputs() -> None:
+    """Remove outputs of earlier runs, so that everything is computed again"""
+    for path in [config.database_path, config.database_path + '-wal', config.database_path + '-shm',
+                 config.reference_index_path, config.structure_cache_path, config.neighborhood_cache_path]:
+        if os.path.exists(path):
+            os.remove(path)
+    for path in [config.excel_cache_dir, config.web_output_dir]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def run_stages(data_dir: str, jobs: int = 1, pages: int = 200) -> dict:
+    """Run all stages on the data set in data_dir, return their times in seconds.
+
+    Must run in a new process: pipeline modules keep some paths of config from their import.
+    """
+    _configure(data_dir)
+    _remove_outputs()
+
+    import pandas as pd
+    import db_access
+    import excel_parser
+    import html_builder
+    from build_metrics import metrics
+    from reference_db import reference_store, _get_pdb_sequence, _get_mapping
+    from search_index import get_search_index_json
+
+    stages = {}
+    counts = {}
+    skipped = []
+
+    @contextmanager
+    def stage(name):
+        start = time.perf_counter()
+        yield
+        stages[name] = time.perf_counter() - start
+
+    db_connection = sqlite3.connect(config.database_path)
+    with open('create_db.sql') as f:
+        db_connection.executescript(f.read())
+    db_connection.close()
+
+    with stage('reference_index'):
+        reference_store.load()
+
+    with stage('excel_parser'):
+        excel_parser.main(jobs=jobs)
+    for (name, value) in metrics.report()['stages'].items():
+        stages[f'excel_parser.{name}'] = value['seconds']
+
+    db_connection = sqlite3.connect(config.database_path)
+    proteins = db_connection.execute("SELECT uniprot_id, protein_sequence FROM mtmod_proteins").fetchall()
+    counts['proteins'] = len(proteins)
+    counts['modifications'] = db_connection.execute("SELECT COUNT(*) FROM mtmod_modifications").fetchone()[0]
+    db_connection.close()
+
+    with stage('pdb_sequences'):
+        pdb_sequences = [_get_pdb_sequence(uniprot_id) for (uniprot_id, _) in proteins]
+    with stage('mapping'):
+        for ((uniprot_id, sequence), pdb_sequence) in zip(proteins, pdb_sequences):
+            _get_mapping(sequence, pdb_sequence)
+
+    modification_df = pd.read_csv(config.modifications_csv_path)
+    modification_df.set_index('Code', inplace=True)
+    modification_list = html_builder.get_modification_list(modification_df)
+    with stage('load_db'):
+        protein_info = db_access.get_protein_info()
+        db_access.get_modification_counts(protein_info, modification_list)
+        modifications = db_access.get_modifications_with_sources()
+    protein_list = [protein_info[uniprot_id] for uniprot_id in sorted(protein_info)]
+    with stage('search_index'):
+        get_search_index_json(protein_list)
+    with stage('database_table'):
+        html_builder.get_database_table_json(protein_list, modification_list)
+
+    # proteins of the sample are spread evenly over the proteome
+    sample = protein_list[::max(1, len(protein_list) // pages)][:pages]
+    counts['pages'] = len(sample)
+    with stage('neighborhoods'), html_builder.NeighborhoodStore() as store:
+        neighborhoods = [html_builder.get_neighborhoods(protein, modifications.get(protein['uniprot_id'], []), store)
+                         for protein in sample]
+    with stage('prepare_protein_page'):
+        sample_pages = [html_builder.prepare_protein_page(protein, False, modification_df,
+                                                          modifications.get(protein['uniprot_id'], []),
+                                                          protein_neighborhoods)
+                        for (protein, protein_neighborhoods) in zip(sample, neighborhoods)]
+
+    try:
+        import pymol2
+    except ImportError:
+        skipped.append('pymol_export')
+        structures = [() for page in sample_pages]
+    else:
+        with stage('pymol_export'), html_builder.StructureRenderer(jobs) as renderer:
+            structures = list(renderer.imap((page['protein_info']['uniprot_id'], page['colored_residues'])
+                                            for page in sample_pages))
+
+    os.makedirs(config.web_output_dir, exist_ok=True)
+    with stage('write_protein_page'):
+        for (page, structure) in zip(sample_pages, structures):
+            html_builder.write_protein_page(page, *structure)
+
+    return {'stages': {name: round(seconds, 6) for (name, seconds) in stages.items()},
+            'counts': counts, 'skipped': skipped}
+
+
+def _get_commit():
+    """Current git commit and whether tracked files differ from it"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', True
+    return commit, bool(status.strip())
+
+
+def _resolve_commit(revision: str) -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', revision], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return revision
+
+
+def get_data_dir(proteins: int, site_density: float, seed: int) -> str:
+    return os.path.join(config.benchmark_data_dir, f'{proteins}_{site_density}_{seed}')
+
+
+def prepare_data(proteins: int, site_density: float, seed: int) -> tuple:
+    """Generate the data set unless it exists, return its directory and the time of generating it"""
+    data_dir = get_data_dir(proteins, site_density, seed)
+    parameters_path = os.path.join(data_dir, synthetic_proteome.PARAMETERS_FILE)
+    if os.path.exists(parameters_path):
+        return data_dir, None
+    shutil.rmtree(data_dir, ignore_errors=True)
+    start = time.perf_counter()
+    synthetic_proteome.generate(data_dir, proteins, site_density, seed)
+    return data_dir, time.perf_counter() - start
+
+
+def _run_in_new_process(data_dir: str, jobs: int, pages: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result_path = os.path.join(tmp_dir, 'result.json')
+        with open(os.path.join(data_dir, 'benchmark.log'), 'w') as log:
+            subprocess.run([sys.executable, __file__, '--run-stages', data_dir, result_path,
+                            '--jobs', str(jobs), '--pages', str(pages)],
+                           stdout=log, stderr=subprocess.STDOUT, check=True)
+        with open(result_path) as f:
+            return json.load(f)
+
+
+def get_result_name(commit: str, dirty: bool, proteins: int, site_density: float, jobs: int) -> str:
+    return f"{commit}{'-dirty' if dirty else ''}_{proteins}_{site_density}_{jobs}.json"
+
+
+def compare(result: dict, old_result: dict) -> None:
+    print(f"{'stage':40s} {'old [s]':>10s} {'new [s]':>10s} {'ratio':>7s}")
+    for (name, seconds) in result['stages'].items():
+        old_seconds = old_result['stages'].get(name)
+        if old_seconds is None:
+            print(f'{name:40s} {"":>10s} {seconds:10.3f}')
+            continue
+        ratio = seconds / old_seconds if old_seconds > 0 else float('inf')
+        print(f"{name:40s} {old_seconds:10.3f} {seconds:10.3f} {ratio:7.2f}"
+              f"{'  slower' if ratio > SLOWER_RATIO else ''}")
+
+
+def main(proteins=(1000,), site_density=0.01, seed=0, jobs=1, pages=200, repeat=1, compare_with=None) -> None:
+    """Generate synthetic data, time the stages of the pipeline on it and save the results"""
+    commit, dirty = _get_commit()
+    os.makedirs(config.benchmark_results_dir, exist_ok=True)
+    for protein_count in proteins:
+        data_dir, generate_seconds = prepare_data(protein_count, site_density, seed)
+        with open(os.path.join(data_dir, synthetic_proteome.PARAMETERS_FILE)) as f:
+            parameters = json.load(f)
+
+        # the fastest time of each stage is kept
+        result = None
+        for i in range(repeat):
+            print(f'Running stages on {protein_count} proteins ({i + 1}/{repeat}), log in {data_dir}/benchmark.log')
+            run = _run_in_new_process(data_dir, jobs, pages)
+            if result is None:
+                result = run
+            else:
+                for (name, seconds) in run['stages'].items():
+                    result['stages'][name] = min(seconds, result['stages'].get(name, seconds))
+
+        result.update({
+            'commit': commit,
+            'dirty': dirty,
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'parameters': dict(parameters, jobs=jobs, pages=pages, repeat=repeat),
+            'generate_seconds': generate_seconds,
+        })
+        path = os.path.join(config.benchmark_results_dir,
+                            get_result_name(commit, dirty, protein_count, site_density, jobs))
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=1)
+        print(f'Results written to {path}')
+        if result['skipped']:
+            print(f"Skipped stages: {', '.join(result['skipped'])}")
+
+        old_path = None
+        if compare_with is not None:
+            old_path = os.path.join(config.benchmark_results_dir,
+                                    get_result_name(_resolve_commit(compare_with), False,
+                                                    protein_count, site_density, jobs))
+        if old_path is None:
+            for (name, seconds) in result['stages'].items():
+                print(f'{name:40s} {seconds:10.3f}')
+        elif not os.path.exists(old_path):
+            print(f'No results of {compare_with} in {old_path} to compare with', file=sys.stderr)
+        else:
+            with open(old_path) as f:
+                compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--proteins", type=int, nargs='+', default=[1000],
+                        help="numbers of proteins of the synthetic data sets, e.g. 1000 10000 100000")
+    parser.add_argument("--site-density", dest="site_density", type=float, default=0.01,
+                        help="probability that an allowed residue has a site of each modification type")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="number of processes of excel_parser.py and PyMOL")
+    parser.add_argument("--pages", type=int, default=200, help="number of protein pages built")
+    parser.add_argument("--repeat", type=int, default=1, help="run the stages this many times, keep the fastest")
+    parser.add_argument("--compare", dest="compare_with", metavar="COMMIT",
+                        help="compare with saved results of a commit, e.g. HEAD~1")
+    parser.add_argument("--run-stages", dest="run_stages", nargs=2, metavar=("DATA_DIR", "RESULT"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_stages:
+        (data_dir, result_path) = args.run_stages
+        with open(result_path, 'w') as f:
+            json.dump(run_stages(data_dir, args.jobs, args.pages), f)
+    else:
+        main(args.proteins, args.site_density, args.seed, args.jobs, args.pages, args.repeat, args.compare_with)
@@ -0,0 +1,56 @@
+"""Manifest of protein pages generated by html_builder.py.
+
+For each page it stores a hash of all inputs used to generate it, so that
+a rebuild of the website can skip pages whose inputs did not change."""
+
+import hashlib
+import json
+import os
+from typing import Iterable
+
+
+def get_file_digest(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                        digest.update(block)
+        return digest.hexdigest()
+
+
+def get_files_digest(paths: Iterable[str]) -> str:
+        """Hash of the names and content of several files"""
+        digest = hashlib.sha256()
+        for path in sorted(paths):
+                digest.update(path.encode())
+                digest.update(get_file_digest(path).encode())
+        return digest.hexdigest()
+
+
+def get_data_digest(data) -> str:
+        """Hash of JSON serializable data"""
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+class BuildManifest:
+        """Mapping from page filenames to the hashes of their inputs, stored as JSON"""
+
+        def __init__(self, path: str):
+                self.path = path
+                self.digests = {}
+                if os.path.exists(path):
+                        with open(path) as file:
+                                self.digests = json.load(file)
+
+        def is_current(self, filename: str, digest: str) -> bool:
+                """True if the page exists and was generated from inputs with this hash"""
+                return (self.digests.get(filename) == digest
+                        and os.path.exists(os.path.join(os.path.dirname(self.path), filename)))
+
+        def update(self, filename: str, digest: str) -> None:
+                self.digests[filename] = digest
+
+        def save(self) -> None:
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w') as file:
+                        json.dump(self.digests, file, indent=0, sort_keys=True)
+                os.replace(tmp_path, self.path)
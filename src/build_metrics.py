@@ -0,0 +1,163 @@
+"""Timing and warning counts of excel_parser.py and html_builder.py, saved as a JSON report.
+
+The scripts measure the wall time of their stages (e.g. Excel load, alignment, download,
+database insert, PyMOL, writing pages), overall and for each protein, and count warnings
+by category. Warnings are still printed to stderr. With profiling enabled, the slowest
+blocks of work on single proteins are profiled by cProfile and their profiles are saved
+next to the report.
+
+The module-level object metrics is shared by all modules of a script."""
+
+import cProfile
+import heapq
+import io
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from sys import stderr
+
+import config
+
+# number of proteins listed among the slowest in the report
+SLOWEST_PROTEINS = 20
+# number of functions listed for each saved profile
+PROFILE_FUNCTIONS = 15
+
+
+class BuildMetrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._captured_warnings = None
+        self.start('build')
+
+    def start(self, script: str, profile: int = 0) -> None:
+        """Reset all metrics at the start of a script.
+
+        profile: number of slowest profiled blocks to keep, 0 disables profiling
+        """
+        self.script = script
+        self.profile = profile
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self._start_time = time.perf_counter()
+        self.stages = defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+        self.proteins = defaultdict(lambda: defaultdict(float))
+        self.warnings = Counter()
+        self.counts = Counter()
+        self._profiles = []
+        self._profile_order = itertools.count()
+
+    def add_time(self, stage: str, seconds: float, uniprot_id: str = None) -> None:
+        with self._lock:
+            self.stages[stage]['seconds'] += seconds
+            self.stages[stage]['calls'] += 1
+            if uniprot_id is not None:
+                self.proteins[uniprot_id][stage] += seconds
+
+    @contextmanager
+    def stage(self, stage: str, uniprot_id: str = None):
+        """Measure wall time of a block as a stage, of a single protein if uniprot_id is given"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, uniprot_id)
+
+    @contextmanager
+    def profiled(self, uniprot_id: str, name: str):
+        """Profile a block of work on one protein if profiling is enabled.
+
+        Only the profiles of the slowest blocks are kept. Blocks must not be nested.
+        """
+        if not self.profile:
+            yield
+            return
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            item = (time.perf_counter() - start, next(self._profile_order), uniprot_id, name, profiler)
+            if len(self._profiles) < self.profile:
+                heapq.heappush(self._profiles, item)
+            else:
+                heapq.heappushpop(self._profiles, item)
+
+    def warn(self, category: str, message: str) -> None:
+        """Print a warning to stderr and count it in its category"""
+        if self._captured_warnings is not None:
+            self._captured_warnings.append((category, message))
+            return
+        with self._lock:
+            self.warnings[category] += 1
+        print(message, file=stderr)
+
+    @contextmanager
+    def captured_warnings(self):
+        """Collect (category, message) of warnings in a block into a list instead of printing them.
+
+        Used in worker processes, whose warnings are passed to warn() by the main process.
+        """
+        captured = []
+        self._captured_warnings = captured
+        try:
+            yield captured
+        finally:
+            self._captured_warnings = None
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counts[name] += value
+
+    def _save_profiles(self, directory: str):
+        profiles = []
+        for (seconds, _, uniprot_id, name, profiler) in sorted(self._profiles, reverse=True):
+            path = os.path.join(directory, f'{self.script}_{uniprot_id}_{name}.prof')
+            profiler.dump_stats(path)
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_FUNCTIONS)
+            profiles.append({'uniprot_id': uniprot_id, 'name': name, 'seconds': round(seconds, 6),
+                             'file': path, 'functions': text.getvalue().splitlines()})
+        return profiles
+
+    def report(self) -> dict:
+        protein_totals = {uniprot_id: sum(stages.values()) for (uniprot_id, stages) in self.proteins.items()}
+        slowest = sorted(protein_totals, key=protein_totals.get, reverse=True)[:SLOWEST_PROTEINS]
+        return {
+            'script': self.script,
+            'started': self.started,
+            'total_seconds': round(time.perf_counter() - self._start_time, 6),
+            'stages': {stage: {'seconds': round(value['seconds'], 6), 'calls': value['calls']}
+                       for (stage, value) in self.stages.items()},
+            'counts': dict(self.counts),
+            'warnings': dict(sorted(self.warnings.items())),
+            'slowest_proteins': [{'uniprot_id': uniprot_id, 'seconds': round(protein_totals[uniprot_id], 6),
+                                  'stages': {stage: round(seconds, 6)
+                                             for (stage, seconds) in self.proteins[uniprot_id].items()}}
+                                 for uniprot_id in slowest],
+            'proteins': {uniprot_id: {stage: round(seconds, 6) for (stage, seconds) in stages.items()}
+                         for (uniprot_id, stages) in self.proteins.items()},
+        }
+
+    def save(self, directory: str = config.build_report_dir) -> str:
+        """Write the report (and profiles) to directory, return the path of the report"""
+        os.makedirs(directory, exist_ok=True)
+        report = self.report()
+        report['profiles'] = self._save_profiles(directory)
+        path = os.path.join(directory, f'{self.script}_report.json')
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f'Build report written to {path}, '
+              f'{sum(self.warnings.values())} warnings in {len(self.warnings)} categories', file=stderr)
+        return path
+
+
+metrics = BuildMetrics()
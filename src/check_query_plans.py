@@ -0,0 +1,72 @@
+"""Checks that queries of html_builder.py and excel_parser.py are backed by indexes.
+
+The script runs the database functions against the SQLite database, records the executed
+queries and checks their plans from EXPLAIN QUERY PLAN. A query fails the check if it scans
+a table in the inner loop of a join, scans a table although it has a WHERE clause,
+or needs a temporary B-tree for GROUP BY. Full scans of a whole table by queries
+without a WHERE clause are intentional and allowed.
+
+Usage: python3 check_query_plans.py [database]
+The exit status is 1 if some query fails the check."""
+
+import sys
+from typing import List
+
+import config
+import db_access
+import excel_parser
+from data_integrity_check import ReferenceIndex
+
+
+def get_plan_problems(db_connection, query: str) -> List[str]:
+    # parameters of statements which were not run are NULL
+    parameters = (None,) * query.count("?")
+    plan = [row[3] for row in db_connection.execute("EXPLAIN QUERY PLAN " + query, parameters)]
+    has_where = " WHERE " in query.upper()
+    problems = []
+    for (i, step) in enumerate(plan):
+        if step.startswith("SCAN") and i > 0:
+            problems.append(f"scan in a join: {step}")
+        elif step.startswith("SCAN") and has_where and "COVERING INDEX" not in step:
+            problems.append(f"scan instead of search: {step}")
+        elif step.startswith("USE TEMP B-TREE FOR GROUP BY"):
+            problems.append(step)
+    return problems
+
+
+def main(database_path: str = config.database_path) -> int:
+    config.database_path = database_path
+    db_access.create_context.cache_clear()
+    db_connection = db_access.create_context()
+
+    queries = []
+    db_connection.set_trace_callback(queries.append)
+
+    # queries of html_builder.py
+    uniprot_ids = db_access.get_all_uniprot_ids()
+    protein_info = db_access.get_protein_info()
+    db_access.get_modification_counts(protein_info, [])
+    db_access.get_modifications_with_sources()
+    uniprot_id = uniprot_ids[0] if uniprot_ids else 'P00000'
+    db_access.get_modifications_with_sources(uniprot_id)
+
+    # queries of excel_parser.py, statements of the delta load are only explained, not run
+    ReferenceIndex(db_connection)
+
+    db_connection.set_trace_callback(None)
+    queries.extend(excel_parser.SQL_QUERIES)
+
+    failed = 0
+    for query in dict.fromkeys(queries):
+        problems = get_plan_problems(db_connection, query)
+        if problems:
+            failed += 1
+            print(f"Query: {query}")
+            for problem in problems:
+                print(f"  {problem}")
+    print(f"Checked {len(set(queries))} queries, {failed} not backed by indexes")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -1,12 +1,23 @@
 """File with paths to data files"""
 
 excel_path = '../data/excel/Sc_mt_PTMs_20230401+stats.xlsx'
+excel_cache_dir = '../data/excel/cache/'
 database_path = '../data/excel/ymtptm.db'
 modifications_csv_path =  '../data/excel/modifications.csv'
 
 sgd_fasta_path = '../data/sgd/orf_trans_all_R64-3-1_20210421.fasta'
 uniprot_fasta_path = '../data/uniprot/UP000002311_559292.fasta'
 sgd_gene_table_path = '../data/sgd/gene_association.sgd.20210510.gaf'
+reference_index_path = '../data/reference_index.db'
 pdb_file_prefix = '../data/pdb/'
+alphafold_pdb_url = 'https://alphafold.ebi.ac.uk/files/AF-{uniprot_id}-F1-model_v2.pdb'
 
 web_output_dir = '../web'
+build_manifest_path = '../web/build_manifest.json'
+structure_cache_path = '../data/pdb/structure_cache.db'
+structure_cache_max_bytes = 2 * 1024 ** 3
+neighborhood_cache_path = '../data/pdb/neighborhoods.db'
+build_report_dir = '../data/reports/'
+benchmark_data_dir = '../data/benchmarks/synthetic/'
+benchmark_results_dir = '../data/benchmarks/results/'
+site_index_path = '../data/excel/site_index.npz'
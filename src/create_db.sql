@@ -43,3 +43,18 @@ CREATE TABLE `mtmod_modification_source` (
     ON UPDATE CASCADE ON DELETE CASCADE
 ); 
 
+
+/* each site has each modification type at most once;
+   the index also serves lookups of modifications by uniprot_id */
+CREATE UNIQUE INDEX IF NOT EXISTS `idx_modifications_site`
+  ON mtmod_modifications (`uniprot_id`, `position`, `modification_type`);
+
+/* covering index for counting modifications of each type per protein */
+CREATE INDEX IF NOT EXISTS `idx_modifications_type`
+  ON mtmod_modifications (`uniprot_id`, `modification_type`);
+
+/* covering index for sources of a modification */
+CREATE INDEX IF NOT EXISTS `idx_modification_source`
+  ON mtmod_modification_source (`modification_id`, `source_id`);
+
+PRAGMA journal_mode = WAL;
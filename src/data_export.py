@@ -0,0 +1,249 @@
+"""Static JSON API and bulk exports of the database, written to the website by html_builder.py.
+
+The API consists of one JSON file for each protein (api/proteins/<uniprot_id>.json) with its
+sequence, mapping to the 3D structure, modification sites and their sources, and of
+api/index.json listing the proteins, modification types and exports. The bulk exports are
+tables of proteins, modifications and sources (api/exports/*.tsv and optionally *.parquet),
+with one row of the modifications table for each modification.
+
+Everything is written in one pass over a single cursor of
+db_access.iter_proteins_with_modifications, so only one protein is held in memory at a time.
+Files of proteins are rewritten only if their content changed."""
+
+import glob
+import json
+import os
+
+from db_access import iter_proteins_with_modifications, get_sources
+from page_writer import COMPRESSIONS, StreamWriter, write_file
+
+# directory of the API in the website
+API_DIR = "api"
+
+# columns of the exported tables with their pyarrow types
+PROTEIN_COLUMNS = [("uniprot_id", "string"), ("systematic_gene_name", "string"),
+                   ("standard_gene_name", "string"), ("protein_name", "string"), ("gene_names", "string"),
+                   ("description", "string"), ("length", "int32"), ("has_mapping", "bool_"),
+                   ("protein_sequence", "string")]
+MODIFICATION_COLUMNS = [("modification_id", "int64"), ("uniprot_id", "string"), ("position", "int32"),
+                        ("residue", "string"), ("modification_type", "string"),
+                        ("structure_residue", "int32"), ("source_ids", "string")]
+SOURCE_COLUMNS = [("source_id", "string"), ("source_description", "string"), ("source_url", "string")]
+
+# rows of a parquet row group, also the number of rows held in memory
+PARQUET_ROW_GROUP = 64 * 1024
+
+
+class _TsvTable:
+        """Table written row by row to a tab separated file"""
+
+        def __init__(self, path, columns, compress=()):
+                self._writer = StreamWriter(path, compress)
+                self._writer.write("\t".join(name for name, _ in columns) + "\n")
+
+        def write(self, row):
+                self._writer.write("\t".join("" if value is None else
+                                             str(value).replace("\t", " ").replace("\n", " ")
+                                             for value in row) + "\n")
+
+        def close(self):
+                self._writer.close()
+
+
+class _ParquetTable:
+        """Table written to a parquet file in row groups of PARQUET_ROW_GROUP rows"""
+
+        def __init__(self, path, columns):
+                import pyarrow
+                import pyarrow.parquet
+                self._pyarrow = pyarrow
+                self._schema = pyarrow.schema([(name, getattr(pyarrow, type_name)()) for name, type_name in columns])
+                self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression="zstd")
+                self._rows = []
+
+        def write(self, row):
+                self._rows.append(row)
+                if len(self._rows) >= PARQUET_ROW_GROUP:
+                        self.flush()
+
+        def flush(self):
+                if not self._rows:
+                        return
+                arrays = [self._pyarrow.array(list(values), type=field.type)
+                          for values, field in zip(zip(*self._rows), self._schema)]
+                self._writer.write_table(self._pyarrow.Table.from_arrays(arrays, schema=self._schema))
+                self._rows = []
+
+        def close(self):
+                try:
+                        self.flush()
+                finally:
+                        self._writer.close()
+
+
+class _Tables:
+        """The same rows written to a table of each export format"""
+
+        def __init__(self, directory, name, columns, compress, parquet):
+                self.tables = [_TsvTable(f"{directory}/{name}.tsv", columns, compress)]
+                if parquet:
+                        self.tables.append(_ParquetTable(f"{directory}/{name}.parquet", columns))
+
+        def write(self, row):
+                for table in self.tables:
+                        table.write(row)
+
+        def close(self):
+                for table in self.tables:
+                        table.close()
+
+
+def _write_if_changed(path, data, compress):
+        """Write data with compressed copies unless the file already has this content"""
+        if all(os.path.exists(path + COMPRESSIONS[compression]) for compression in compress):
+                try:
+                        with open(path, "rb") as f:
+                                if f.read() == data:
+                                        return False
+                except FileNotFoundError:
+                        pass
+        write_file(path, data, compress)
+        return True
+
+
+def get_protein_json(protein, modifications, source_info):
+        """Content of the API file of a protein.
+
+        protein: protein row of iter_proteins_with_modifications
+        modifications: list of (position, modification_id, modification_type, source_ids) ordered by position
+        source_info: description and url of each source, by source_id
+        """
+        (uniprot_id, _, systematic_gene_name, standard_gene_name, protein_name, gene_names,
+         description, sequence, mapping) = protein
+        if mapping is not None:
+                mapping = json.loads(mapping)
+
+        sites = []
+        types = {}
+        source_ids = {}
+        for position, modification_id, modification_type, modification_sources in modifications:
+                if not sites or sites[-1]["position"] != position:
+                        structure_residue = None
+                        if mapping is not None and mapping[position - 1] != -1:
+                                structure_residue = mapping[position - 1] + 1
+                        sites.append({"position": position, "residue": sequence[position - 1],
+                                      "structure_residue": structure_residue, "modifications": []})
+                sites[-1]["modifications"].append({"type": modification_type, "sources": modification_sources})
+                types[modification_type] = types.get(modification_type, 0) + 1
+                source_ids.update(dict.fromkeys(modification_sources))
+
+        return {
+                "uniprot_id": uniprot_id,
+                "systematic_gene_name": systematic_gene_name,
+                "standard_gene_name": standard_gene_name,
+                "protein_name": protein_name,
+                "gene_names": gene_names.split(),
+                "description": description,
+                "length": len(sequence),
+                "sequence": sequence,
+                # 0-based position in the structure of each residue, -1 for residues missing in it
+                "mapping": mapping,
+                "page": f"../../{uniprot_id}.html",
+                "types": types,
+                "sites": sites,
+                "sources": {source_id: {"description": source_info[source_id][0], "url": source_info[source_id][1]}
+                            for source_id in source_ids if source_id in source_info},
+        }
+
+
+def _group_proteins(rows):
+        """Group rows of iter_proteins_with_modifications to (protein row, modifications)"""
+        protein = None
+        modifications = []
+        for row in rows:
+                if row[1] == 0:
+                        if protein is not None:
+                                yield protein, modifications
+                        protein = row
+                        modifications = []
+                        continue
+                (uniprot_id, _, position, modification_id, modification_type, source_id) = row[:6]
+                # modifications of proteins missing in mtmod_proteins are skipped
+                if protein is None or uniprot_id != protein[0]:
+                        continue
+                if not modifications or modifications[-1][1] != modification_id:
+                        modifications.append((position, modification_id, modification_type, []))
+                if source_id is not None:
+                        modifications[-1][3].append(source_id)
+        if protein is not None:
+                yield protein, modifications
+
+
+def write_api(output_dir, modification_df, compress=(), parquet=False):
+        """Write the JSON API and the bulk exports to output_dir/API_DIR, return the number of changed protein files.
+
+        modification_df: modifications.csv indexed by Code
+        compress: formats of compressed copies, see page_writer.COMPRESSIONS
+        parquet: also write the exports in parquet format, requires the pyarrow package
+        """
+        api_dir = f"{output_dir}/{API_DIR}"
+        proteins_dir = f"{api_dir}/proteins"
+        exports_dir = f"{api_dir}/exports"
+        os.makedirs(proteins_dir, exist_ok=True)
+        os.makedirs(exports_dir, exist_ok=True)
+
+        source_info = get_sources()
+        protein_table = _Tables(exports_dir, "proteins", PROTEIN_COLUMNS, compress, parquet)
+        modification_table = _Tables(exports_dir, "modifications", MODIFICATION_COLUMNS, compress, parquet)
+        index = []
+        changed = 0
+        try:
+                for protein, modifications in _group_proteins(iter_proteins_with_modifications()):
+                        data = get_protein_json(protein, modifications, source_info)
+                        uniprot_id = data["uniprot_id"]
+                        if _write_if_changed(f"{proteins_dir}/{uniprot_id}.json",
+                                             json.dumps(data, separators=(',', ':')).encode(), compress):
+                                changed += 1
+                        index.append({key: data[key] for key in
+                                      ["uniprot_id", "systematic_gene_name", "standard_gene_name",
+                                       "protein_name", "length", "types"]})
+                        index[-1]["url"] = f"proteins/{uniprot_id}.json"
+
+                        protein_table.write([uniprot_id, data["systematic_gene_name"], data["standard_gene_name"],
+                                             data["protein_name"], " ".join(data["gene_names"]), data["description"],
+                                             data["length"], data["mapping"] is not None, data["sequence"]])
+                        for (position, modification_id, modification_type, source_ids) in modifications:
+                                structure_residue = None
+                                if data["mapping"] is not None and data["mapping"][position - 1] != -1:
+                                        structure_residue = data["mapping"][position - 1] + 1
+                                modification_table.write([modification_id, uniprot_id, position,
+                                                          data["sequence"][position - 1], modification_type,
+                                                          structure_residue, ";".join(source_ids)])
+        finally:
+                protein_table.close()
+                modification_table.close()
+
+        source_table = _Tables(exports_dir, "sources", SOURCE_COLUMNS, compress, parquet)
+        try:
+                for source_id, (source_description, source_url) in source_info.items():
+                        source_table.write([source_id, source_description, source_url])
+        finally:
+                source_table.close()
+
+        # files of proteins which are not in the database any more, with their compressed copies
+        uniprot_ids = {protein["uniprot_id"] for protein in index}
+        for path in glob.glob(f"{proteins_dir}/*.json*"):
+                if os.path.basename(path).split(".")[0] not in uniprot_ids:
+                        os.remove(path)
+
+        formats = ["tsv"] + (["parquet"] if parquet else [])
+        api_index = {
+                "proteins": index,
+                "modification_types": [{"code": code, "name": row.Full_name, "amino_acids": row.Amino_acids}
+                                       for code, row in zip(modification_df.index, modification_df.itertuples())
+                                       if code != "multiple"],
+                "exports": {name: {file_format: f"exports/{name}.{file_format}" for file_format in formats}
+                            for name in ["proteins", "modifications", "sources"]},
+        }
+        write_file(f"{api_dir}/index.json", json.dumps(api_index, separators=(',', ':')).encode(), compress)
+        return changed
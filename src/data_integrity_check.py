@@ -1,6 +1,11 @@
 """Several functions for checking data from the Excel file"""
 
-from sys import stderr
+from typing import Dict, Set
+
+import numpy as np
+import pandas as pd
+
+from build_metrics import metrics
 
 def compare_excel_sequence_length_and_reference_sequence_length(
     uniprot_id: str,
@@ -8,50 +13,79 @@ def compare_excel_sequence_length_and_reference_sequence_length(
     reference_sequence: str
 ) -> None:
     if len(reference_sequence) != excel_length:
-        print(
+        metrics.warn(
+            'sequence_length_mismatch',
             f'Protein {uniprot_id} has different sequence length in excel {excel_length} '
             f'than length of reference sequence {len(reference_sequence)}. '
-            f'Inserting protein anyway.', file=stderr
+            f'Inserting protein anyway.'
         )
 
 
-def _get_reference_sequence(uniprot_id: str, db_connection) -> str:
-    cursor = db_connection.cursor()
-    cursor.execute(f"SELECT protein_sequence FROM mtmod_proteins WHERE uniprot_id = '{uniprot_id}'")
-    result = cursor.fetchone()
+class ReferenceIndex:
+    """Reference sequences and source ids from the database, loaded once into memory.
 
-    assert cursor.fetchone() is None
-    return None if result is None else result[0]
+    All sequences are concatenated into one array, so that residues at many
+    positions can be looked up at once.
+    """
 
+    def __init__(self, db_connection):
+        cursor = db_connection.cursor()
+        cursor.execute("SELECT uniprot_id, protein_sequence FROM mtmod_proteins")
+        self.sequences: Dict[str, str] = dict(cursor.fetchall())
+        cursor.execute("SELECT source_id FROM mtmod_source")
+        self.source_ids: Set[str] = {row[0] for row in cursor.fetchall()}
 
-def has_modifications_on_correct_aminoacids(
-    uniprot_id: str,
+        self.offsets: Dict[str, int] = {}
+        self.lengths: Dict[str, int] = {}
+        offset = 0
+        for uniprot_id, sequence in self.sequences.items():
+            self.offsets[uniprot_id] = offset
+            self.lengths[uniprot_id] = len(sequence)
+            offset += len(sequence)
+        self.residues = np.frombuffer("".join(self.sequences.values()).encode('ascii'), dtype='S1')
+
+
+def check_modification_sites(
+    uniprot_ids: pd.Series,
+    positions: pd.Series,
     allowed_amino_acids: str,
-    position: int,
-    modification_type : str,
-    db_connection    
-) -> bool:
-    sequence = _get_reference_sequence(uniprot_id, db_connection)
-
-    if sequence is None:
-        print(
-            f"'Position {position} of modification {modification_type} in {uniprot_id} can not be verified, protein not in db. "
-            f'Might be skipped due to an error in previous phase. Modification will not be inserted!.', file=stderr
-        )
-        return False
+    modification_type: str,
+    reference_index: ReferenceIndex
+) -> pd.Series:
+    """Check modification sites of a whole sheet against reference sequences.
 
-    if position > len(sequence):
-        print(
-            f'Position of modification {position} is outside of protein {uniprot_id} with sequence length {len(sequence)}. '
-            f'Modification will not be inserted!', file=stderr
+    Sites of proteins missing in the database or outside of their protein are reported
+    and rejected, sites on amino acids other than allowed_amino_acids are reported only.
+    Returns a boolean Series which is True for modifications that should be inserted.
+    """
+    lengths = uniprot_ids.map(reference_index.lengths)
+    known = lengths.notna()
+    for index in uniprot_ids.index[~known]:
+        metrics.warn(
+            'protein_not_in_db',
+            f"'Position {positions[index]} of modification {modification_type} in {uniprot_ids[index]} can not be verified, protein not in db. "
+            f'Might be skipped due to an error in previous phase. Modification will not be inserted!.'
         )
-        return False
-
-    amino_acid = sequence[position - 1]
-    if allowed_amino_acids != "*" and amino_acid not in allowed_amino_acids:
-        print(
-            f'Protein {uniprot_id} has modification {modification_type} '
-            f'on amino acid {amino_acid}, position {position}, '
-            f'allowed {allowed_amino_acids}.', file=stderr
+
+    inside = known & (positions >= 1) & (positions <= lengths)
+    for index in uniprot_ids.index[known & ~inside]:
+        metrics.warn(
+            'position_outside_protein',
+            f'Position of modification {positions[index]} is outside of protein {uniprot_ids[index]} with sequence length {int(lengths[index])}. '
+            f'Modification will not be inserted!'
         )
-    return True
+
+    if allowed_amino_acids != "*":
+        inside_ids = uniprot_ids[inside]
+        inside_positions = positions[inside]
+        residue_indices = inside_ids.map(reference_index.offsets).to_numpy(dtype=np.int64) + inside_positions.to_numpy(dtype=np.int64) - 1
+        amino_acids = reference_index.residues[residue_indices]
+        allowed = np.isin(amino_acids, np.array(list(allowed_amino_acids), dtype='S1'))
+        for index, amino_acid in zip(inside_ids.index[~allowed], amino_acids[~allowed]):
+            metrics.warn(
+                'unexpected_amino_acid',
+                f'Protein {uniprot_ids[index]} has modification {modification_type} '
+                f'on amino acid {amino_acid.decode()}, position {positions[index]}, '
+                f'allowed {allowed_amino_acids}.'
+            )
+    return inside
@@ -0,0 +1,134 @@
+"""Functions reading the SQLite database of proteins and modifications for html_builder.py.
+
+All functions share one read-only connection to the database."""
+
+import functools
+import json
+import sqlite3
+from typing import Dict, List, Tuple
+
+import config
+
+
+@functools.lru_cache(maxsize=None)
+def create_context():
+        # connect to a database, only for reading
+        return sqlite3.connect(f"file:{config.database_path}?mode=ro", uri=True)
+
+
+def get_all_uniprot_ids() -> List[str]:
+        cnx = create_context()
+        cursor = cnx.cursor()
+        cursor.execute("SELECT DISTINCT uniprot_id FROM mtmod_proteins")
+        uniprot_ids = [row[0] for row in cursor]
+        return uniprot_ids
+
+def get_protein_info():
+        cnx = create_context()
+        cursor = cnx.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(
+                "SELECT uniprot_id, protein_name, systematic_gene_name, standard_gene_name, gene_names, description, protein_sequence, mapping "
+                "FROM mtmod_proteins ORDER BY uniprot_id"
+        )
+
+        # get all rows to a dictionary with uniprot_id as key
+        result = {row['uniprot_id']:dict(row) for row in cursor}
+        
+        # fix mapping, compute protein length
+        for id, row in result.items():
+                if row['mapping'] is not None:
+                        row['mapping'] = json.loads(row['mapping'])
+                row['length'] = len(row['protein_sequence'])
+                
+        return result
+
+def get_modification_counts(protein_info, modification_list):
+        """Add modification counts to protein_info"""
+        
+        cnx = create_context()
+        cursor = cnx.cursor()
+        cursor.execute(
+                "SELECT COUNT(*),uniprot_id, modification_type FROM mtmod_modifications GROUP BY uniprot_id, modification_type"
+                )
+
+        count_dict = {(row[1], row[2]):row[0] for row in cursor}
+        for uniprot_id, row in protein_info.items():
+                for mod_record in modification_list:
+                        mod_type =  mod_record["Code"]
+                        key = (uniprot_id, mod_type)
+                        if key in count_dict:
+                                row[mod_type] = count_dict[key]
+                        else:
+                                row[mod_type] = 0
+
+
+def get_modifications_with_sources(
+        uniprot_id: str = None
+) -> Dict[str, List[Tuple[int, str, int, List[Tuple[str, str]]]]]:
+        """Modifications of all proteins (or of one protein) with their sources, read by a single query.
+
+        Returns a dictionary with uniprot_id as key. Each value is a list of modifications
+        ordered by position, each modification is a tuple (position, modification_type,
+        modification_id, sources) where sources is a list of (source_description, source_url).
+        """
+        query = ("SELECT m.uniprot_id, m.position, m.modification_type, m.modification_id, "
+                 "s.source_id, s.source_description, s.source_url "
+                 "FROM mtmod_modifications m "
+                 "LEFT JOIN mtmod_modification_source ms ON ms.modification_id = m.modification_id "
+                 "LEFT JOIN mtmod_source s ON s.source_id = ms.source_id ")
+        parameters = ()
+        if uniprot_id is not None:
+                query += "WHERE m.uniprot_id = ? "
+                parameters = (uniprot_id,)
+        query += "ORDER BY m.uniprot_id, m.position, m.modification_id, ms.rowid"
+
+        cnx = create_context()
+        cursor = cnx.cursor()
+        cursor.execute(query, parameters)
+
+        result = {}
+        for (protein_id, position, modification_type, modification_id,
+             source_id, source_description, source_url) in cursor:
+                modifications = result.setdefault(protein_id, [])
+                if not modifications or modifications[-1][2] != modification_id:
+                        modifications.append((position, modification_type, modification_id, []))
+                # source ids missing in mtmod_source are skipped
+                if source_id is not None:
+                        modifications[-1][3].append((source_description, source_url))
+        return result
+
+
+def iter_proteins_with_modifications():
+        """Stream all proteins, each followed by its modifications, from a single cursor.
+
+        Rows come in the order of uniprot_id. The row of a protein is
+        (uniprot_id, 0, systematic_gene_name, standard_gene_name, protein_name, gene_names,
+        description, protein_sequence, mapping), rows of its modifications follow ordered
+        by position, one for each source: (uniprot_id, 1, position, modification_id,
+        modification_type, source_id, None, None, None), with source_id None if it has no source.
+        The rows are merged and ordered by SQLite, so memory use does not grow with the database.
+        """
+        cnx = create_context()
+        cursor = cnx.cursor()
+        cursor.execute(
+                "SELECT uniprot_id, 0, systematic_gene_name, standard_gene_name, protein_name, gene_names, "
+                "description, protein_sequence, mapping, NULL "
+                "FROM mtmod_proteins "
+                "UNION ALL "
+                "SELECT m.uniprot_id, 1, m.position, m.modification_id, m.modification_type, ms.source_id, "
+                "NULL, NULL, NULL, ms.rowid "
+                "FROM mtmod_modifications m "
+                "LEFT JOIN mtmod_modification_source ms ON ms.modification_id = m.modification_id "
+                "ORDER BY 1, 2, 3, 4, 10"
+        )
+        for row in cursor:
+                yield row[:9]
+
+
+def get_sources() -> Dict[str, Tuple[str, str]]:
+        """Description and url of each source, by source_id"""
+        cnx = create_context()
+        cursor = cnx.cursor()
+        cursor.execute("SELECT source_id, source_description, source_url FROM mtmod_source ORDER BY position")
+        return {row[0]: (row[1], row[2]) for row in cursor}
@@ -1,26 +1,140 @@
-"""The main script for parsing the database in Excel format and storing it in SQLite database which needs to be created beforehand."""
+"""The main script for parsing the database in Excel format and storing it in SQLite database which needs to be created beforehand.
+
+With --delta, an existing database is updated to the Excel file instead: rows of each sheet
+are compared with the database and only inserts, updates and deletes of changed rows
+are applied, in one transaction. Reference sequences, mappings and structures are computed
+only for new proteins and proteins with a changed systematic gene name."""
 
 import sqlite3
 import json
 import pandas as pd
 import re
+import argparse
+import multiprocessing
+import time
 import config
-from sys import stderr, stdout
+from collections import defaultdict
+from sys import stdout
+from typing import Dict, List, Tuple
 
 from tqdm import tqdm
-from reference_db import get_protein_info, \
+from excel_workbook import load_sheets
+from build_metrics import metrics
+from reference_db import get_protein_info, download_pdbs, \
     has_valid_systematic_gene_name_and_uniprot_id
-from data_integrity_check import has_modifications_on_correct_aminoacids,   \
+from data_integrity_check import ReferenceIndex, check_modification_sites,   \
     compare_excel_sequence_length_and_reference_sequence_length
 
 
-def fill_proteins(db_connection) -> None:
-    cursor = db_connection.cursor()
-
-    proteome_sheet = pd.read_excel(
-        config.excel_path,
-        sheet_name='24_Reference mt proteome'
-    )
+PROTEOME_SHEET = '24_Reference mt proteome'
+SOURCES_SHEET = '1_References'
+
+# reference index of the current worker process reading modification sheets
+_reference_index = None
+
+SQL_INSERT_PROTEIN = """
+    INSERT INTO mtmod_proteins
+      (uniprot_id, systematic_gene_name, standard_gene_name, 
+       protein_name, gene_names, description, 
+       protein_sequence, mapping)
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_INSERT_SOURCE = """
+    INSERT INTO mtmod_source
+      (source_id, source_description, source_url, annotation, position)
+      VALUES (?, ?, ?, ?, ?)
+"""
+
+SQL_INSERT_MODIFICATION = """
+    INSERT INTO mtmod_modifications 
+      (modification_id, uniprot_id, position, modification_type)
+      VALUES (?, ?, ?, ?)
+"""
+
+SQL_INSERT_MODIFICATION_SOURCE = """
+    INSERT INTO mtmod_modification_source
+      (modification_id, source_id)
+      VALUES (?, ?)
+"""
+
+SQL_SELECT_MAX_MODIFICATION_ID = "SELECT COALESCE(MAX(modification_id), 0) FROM mtmod_modifications"
+
+# statements of the delta load
+SQL_SELECT_PROTEINS = """
+    SELECT uniprot_id, systematic_gene_name, standard_gene_name, protein_name, gene_names
+      FROM mtmod_proteins
+"""
+SQL_DELETE_PROTEIN = "DELETE FROM mtmod_proteins WHERE uniprot_id = ?"
+SQL_UPDATE_PROTEIN = """
+    UPDATE mtmod_proteins
+      SET standard_gene_name = ?, protein_name = ?, gene_names = ?
+      WHERE uniprot_id = ?
+"""
+SQL_SELECT_SOURCES = "SELECT source_id, source_description, source_url, annotation, position FROM mtmod_source"
+SQL_DELETE_SOURCE = "DELETE FROM mtmod_source WHERE source_id = ?"
+SQL_UPDATE_SOURCE = """
+    UPDATE mtmod_source
+      SET source_description = ?, source_url = ?, annotation = ?, position = ?
+      WHERE source_id = ?
+"""
+SQL_SELECT_MODIFICATIONS = "SELECT modification_id, uniprot_id, position, modification_type FROM mtmod_modifications"
+SQL_SELECT_MODIFICATION_SOURCES = "SELECT modification_id, source_id FROM mtmod_modification_source"
+SQL_DELETE_MODIFICATION_SOURCES = "DELETE FROM mtmod_modification_source WHERE modification_id = ?"
+SQL_DELETE_MODIFICATION = "DELETE FROM mtmod_modifications WHERE modification_id = ?"
+
+# queries of the parser checked by check_query_plans.py, besides those of ReferenceIndex
+SQL_QUERIES = [SQL_SELECT_MAX_MODIFICATION_ID, SQL_SELECT_PROTEINS, SQL_DELETE_PROTEIN, SQL_UPDATE_PROTEIN,
+               SQL_SELECT_SOURCES, SQL_DELETE_SOURCE, SQL_UPDATE_SOURCE, SQL_SELECT_MODIFICATIONS,
+               SQL_SELECT_MODIFICATION_SOURCES, SQL_DELETE_MODIFICATION_SOURCES, SQL_DELETE_MODIFICATION]
+
+
+def _get_gene_names(row) -> str:
+    """Gene names of a row of the proteome sheet, with std gene name first"""
+    name_list = row.gene_names.split()
+    if len(name_list) == 0 or name_list[0] != row.std_gene_name:
+        old_name_list = name_list.copy()
+        if row.std_gene_name in name_list:
+            name_list.remove(row.std_gene_name)
+        name_list.insert(0, row.std_gene_name)
+        if old_name_list != name_list:
+            metrics.warn('gene_names_reordered',
+                         f"Gene name list changed from {old_name_list} to {name_list} uniprot_id={row.uniprot_id}")
+    return " ".join(name_list)
+
+
+def _fill_one_protein(cursor, sql_query, row) -> bool:
+    """Insert the protein of one row of the proteome sheet, return whether it was inserted"""
+    protein_sequence, mapping, description = get_protein_info(row.sys_gene_name, row.uniprot_id)
+
+    if protein_sequence is None:
+        return False
+
+    compare_excel_sequence_length_and_reference_sequence_length(row.uniprot_id, row.protein_length, protein_sequence)
+
+    # make sure that std gene name is the first in gene name list
+    gene_names = _get_gene_names(row)
+    
+    if mapping is not None:
+        mapping = json.dumps(mapping)
+    try:
+        with metrics.stage('db_insert', row.uniprot_id):
+            cursor.execute(sql_query,
+                           (row.uniprot_id, row.sys_gene_name,
+                            row.std_gene_name, row.prot_name,
+                            gene_names, description, protein_sequence, mapping))
+        metrics.count('proteins_inserted')
+        return True
+    except Exception as e:
+        metrics.warn('protein_insert_error', f"{e} uniprot_id={row.uniprot_id}, sys_gene_name={row.sys_gene_name}")
+        return False
+
+
+def _get_protein_rows(sheets=None) -> list:
+    """Rows of the proteome sheet with a valid systematic gene name and uniprot id"""
+    if sheets is None:
+        sheets = load_sheets([PROTEOME_SHEET])
+    proteome_sheet = sheets[PROTEOME_SHEET]
     names_dict = {
         'Systematic gene name' : 'sys_gene_name',
         'Standard gene name' : 'std_gene_name',
@@ -31,61 +145,86 @@ def fill_proteins(db_connection) -> None:
     }
     proteome_sheet.rename(columns=names_dict, inplace=True)
 
-    
-    sql_query = """
-        INSERT INTO mtmod_proteins
-          (uniprot_id, systematic_gene_name, standard_gene_name, 
-           protein_name, gene_names, description, 
-           protein_sequence, mapping)
-          VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """
+    with metrics.stage('validate_proteins'):
+        return [row for row in proteome_sheet.itertuples()
+                if has_valid_systematic_gene_name_and_uniprot_id(row.sys_gene_name, row.uniprot_id)]
 
-    for row in tqdm(proteome_sheet.itertuples(),
-                    total=len(proteome_sheet), desc='Populating proteins',
-                    file=stdout):
 
-        if not has_valid_systematic_gene_name_and_uniprot_id(row.sys_gene_name, row.uniprot_id):
-            continue
+def fill_proteins(db_connection, sheets=None) -> None:
+    cursor = db_connection.cursor()
 
-        protein_sequence, mapping, description = get_protein_info(row.sys_gene_name, row.uniprot_id)
+    valid_rows = _get_protein_rows(sheets)
 
-        if protein_sequence is None:
-            continue
+    # download all missing structures in parallel before computing mappings
+    with metrics.stage('structure_downloads'):
+        download_pdbs(row.uniprot_id for row in valid_rows)
 
-        compare_excel_sequence_length_and_reference_sequence_length(row.uniprot_id, row.protein_length, protein_sequence)
-
-        # make sure that std gene name is the first in gene name list
-        name_list = row.gene_names.split()
-        if len(name_list) == 0 or name_list[0] != row.std_gene_name:
-            old_name_list = name_list.copy()
-            if row.std_gene_name in name_list:
-                name_list.remove(row.std_gene_name)
-            name_list.insert(0, row.std_gene_name)
-            if old_name_list != name_list:
-                print(f"Gene name list changed from {old_name_list} to {name_list} uniprot_id={row.uniprot_id}", file=stderr)
-        gene_names = " ".join(name_list)
-        
-        if mapping is not None:
-            mapping = json.dumps(mapping)
-        try:
-            cursor.execute(sql_query,
-                           (row.uniprot_id, row.sys_gene_name,
-                            row.std_gene_name, row.prot_name,
-                            gene_names, description, protein_sequence, mapping))
-        except Exception as e:
-            print(e, f"uniprot_id={row.uniprot_id}, sys_gene_name={row.sys_gene_name}", file=stderr)
+    for row in tqdm(valid_rows, desc='Populating proteins', file=stdout):
+        with metrics.profiled(row.uniprot_id, 'protein'):
+            _fill_one_protein(cursor, SQL_INSERT_PROTEIN, row)
 
-            
     db_connection.commit()
 
 
-def fill_sources(db_connection) -> None:
+def update_proteins(db_connection, sheets=None) -> None:
+    """Update proteins of the database to the proteome sheet, without committing.
+
+    Proteins missing in the sheet are deleted (their modifications are deleted
+    by update_modifications). Proteins with changed names are updated in place.
+    Only new proteins and proteins with a changed systematic gene name are looked up
+    in reference tables, aligned to their structures and inserted again.
+    """
     cursor = db_connection.cursor()
 
-    source_sheet = pd.read_excel(
-        config.excel_path,
-        sheet_name='1_References'
-    )
+    valid_rows = _get_protein_rows(sheets)
+
+    cursor.execute(SQL_SELECT_PROTEINS)
+    old_proteins = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    sheet_ids = set()
+    changed_rows = []
+    updated_rows = []
+    for row in valid_rows:
+        if row.uniprot_id in sheet_ids:
+            metrics.warn('protein_insert_error',
+                         f"Duplicate protein uniprot_id={row.uniprot_id}, sys_gene_name={row.sys_gene_name}")
+            continue
+        sheet_ids.add(row.uniprot_id)
+        old_protein = old_proteins.get(row.uniprot_id)
+        if old_protein is None or old_protein[0] != row.sys_gene_name:
+            changed_rows.append(row)
+            continue
+        names = (row.std_gene_name, row.prot_name, _get_gene_names(row))
+        if names != old_protein[1:]:
+            updated_rows.append(names + (row.uniprot_id,))
+    deleted_ids = [(uniprot_id,) for uniprot_id in old_proteins if uniprot_id not in sheet_ids]
+
+    # proteins inserted again are deleted first, so that changed names do not clash
+    with metrics.stage('db_insert'):
+        cursor.executemany(SQL_DELETE_PROTEIN,
+                           deleted_ids + [(row.uniprot_id,) for row in changed_rows
+                                          if row.uniprot_id in old_proteins])
+        cursor.executemany(SQL_UPDATE_PROTEIN, updated_rows)
+
+    with metrics.stage('structure_downloads'):
+        download_pdbs(row.uniprot_id for row in changed_rows)
+
+    inserted = 0
+    for row in tqdm(changed_rows, desc='Populating changed proteins', file=stdout):
+        with metrics.profiled(row.uniprot_id, 'protein'):
+            inserted += _fill_one_protein(cursor, SQL_INSERT_PROTEIN, row)
+
+    metrics.count('proteins_updated', len(updated_rows))
+    metrics.count('proteins_deleted', len(deleted_ids))
+    print(f"Proteins: {inserted} inserted, {len(updated_rows)} updated, {len(deleted_ids)} deleted, "
+          f"{len(sheet_ids) - len(changed_rows) - len(updated_rows)} unchanged")
+
+
+def _get_source_rows(sheets=None) -> list:
+    """Rows of the sources sheet with their positions, as inserted into mtmod_source"""
+    if sheets is None:
+        sheets = load_sheets([SOURCES_SHEET])
+    source_sheet = sheets[SOURCES_SHEET]
 
     names_dict = {
     'Short reference:' : 'source_id',
@@ -93,63 +232,149 @@ def fill_sources(db_connection) -> None:
     'DOI' : 'source_url',
     'Annotation' : 'annotation'    
     }
-    #print(",".join(source_sheet.columns) + "*")
     source_sheet.rename(columns=names_dict, inplace=True)
-    #print(",".join(source_sheet.columns) + "*")
-    
-    sql_query = """
-        INSERT INTO mtmod_source
-          (source_id, source_description, source_url, annotation, position)
-          VALUES (?, ?, ?, ?, ?)
-    """
 
-    position = 0;
-    for row in tqdm(source_sheet.itertuples(), total=len(source_sheet), desc='Populating sources', file=stdout):
+    source_rows = []
+    source_ids = set()
+    for row in source_sheet.itertuples():
 
         # skip rows without ID (empty etc)
         if pd.isna(row.source_id):
             continue
 
+        source_id = str(row.source_id).strip()
+        if source_id in source_ids:
+            metrics.warn('source_insert_error', f"Duplicate source {source_id}")
+            continue
+        source_ids.add(source_id)
+        source_rows.append((source_id,
+                            str(row.source_description).strip(),
+                            str(row.source_url).strip(),
+                            str(row.annotation).strip(),
+                            len(source_rows)))
+    return source_rows
+
+
+def fill_sources(db_connection, sheets=None) -> None:
+    cursor = db_connection.cursor()
+
+    for source_row in tqdm(_get_source_rows(sheets), desc='Populating sources', file=stdout):
         try:
-            cursor.execute(sql_query, (str(row.source_id).strip(),
-                                       str(row.source_description).strip(),
-                                       str(row.source_url).strip(),
-                                       str(row.annotation).strip(),
-                                       position))
-            position += 1
+            cursor.execute(SQL_INSERT_SOURCE, source_row)
         except Exception as e:
-            print(e, f"{row.source_id}", file=stderr)
+            metrics.warn('source_insert_error', f"{e} {source_row[0]}")
 
     db_connection.commit()
 
-def fill_modifications(db_connection) -> None:
-    # read table of modifications
-    modifications_df = pd.read_csv(config.modifications_csv_path)
-    for row in modifications_df.itertuples():
-        if row.Code == "multiple":
-            continue
-        print("Starting modification", row.Sheet, row.Code, row.Amino_acids)
-        fill_one_modification(db_connection, row.Sheet, row.Code, row.Amino_acids)
 
-def fill_one_modification(db_connection, sheet_name, modification_type, allowed_amino_acids) -> None:
+def update_sources(db_connection, sheets=None) -> None:
+    """Update sources of the database to the sources sheet, without committing"""
     cursor = db_connection.cursor()
 
-    proteome_sheet = pd.read_excel(
-        config.excel_path,
-        sheet_name=sheet_name
-    )
+    source_rows = _get_source_rows(sheets)
+
+    cursor.execute(SQL_SELECT_SOURCES)
+    old_sources = {row[0]: row for row in cursor.fetchall()}
+
+    inserted_rows = [row for row in source_rows if row[0] not in old_sources]
+    updated_rows = [row[1:] + row[:1] for row in source_rows
+                    if row[0] in old_sources and row != old_sources[row[0]]]
+    sheet_ids = {row[0] for row in source_rows}
+    deleted_ids = [(source_id,) for source_id in old_sources if source_id not in sheet_ids]
+
+    # sources of modifications are updated together with the modifications
+    with metrics.stage('db_insert'):
+        cursor.executemany(SQL_DELETE_SOURCE, deleted_ids)
+        cursor.executemany(SQL_UPDATE_SOURCE, updated_rows)
+        cursor.executemany(SQL_INSERT_SOURCE, inserted_rows)
+
+    metrics.count('sources_inserted', len(inserted_rows))
+    metrics.count('sources_updated', len(updated_rows))
+    metrics.count('sources_deleted', len(deleted_ids))
+    print(f"Sources: {len(inserted_rows)} inserted, {len(updated_rows)} updated, {len(deleted_ids)} deleted")
+
+def get_modification_sheet_names():
+    modifications_df = pd.read_csv(config.modifications_csv_path)
+    return [row.Sheet for row in modifications_df.itertuples() if row.Code != "multiple"]
+
+def _set_reference_index(reference_index) -> None:
+    global _reference_index
+    _reference_index = reference_index
+
 
-    sql_query_modifications = """
-        INSERT INTO mtmod_modifications 
-          (uniprot_id, position, modification_type)
-          VALUES (?, ?, ?)
+def _get_modification_sites_timed(job):
+    """get_modification_sites of one sheet in a worker process.
+
+    Returns the sites, the warnings of the sheet and the time it took. The warnings
+    are printed and counted by the main process, so that they appear in the order of sheets.
     """
+    sheet_name, modification_type, allowed_amino_acids, sheet = job
+    start = time.perf_counter()
+    with metrics.captured_warnings() as warnings:
+        sites = get_modification_sites(sheet_name, modification_type, allowed_amino_acids,
+                                       _reference_index, {sheet_name: sheet})
+    return sites, warnings, time.perf_counter() - start
+
 
-    sql_query_modifications_source = """
-        INSERT INTO mtmod_modification_source
-          (modification_id, source_id)
-          VALUES (?, ?)
+def _iter_modification_sites(reference_index, sheets, jobs: int = 1):
+    """Yield (modification type, sites) of the modification sheets in the order of modifications.csv.
+
+    With jobs > 1 the sheets are read and checked by a pool of worker processes. Results and
+    warnings of each sheet are still handled here one sheet after another, in the same order
+    as with one job.
+    """
+    modification_types = [row for row in pd.read_csv(config.modifications_csv_path).itertuples()
+                          if row.Code != "multiple"]
+    if jobs <= 1:
+        for row in modification_types:
+            print("Starting modification", row.Sheet, row.Code, row.Amino_acids)
+            with metrics.stage('modification_sheets'):
+                sites = get_modification_sites(row.Sheet, row.Code, row.Amino_acids, reference_index, sheets)
+            yield row.Code, sites
+        return
+
+    pool_jobs = [(row.Sheet, row.Code, row.Amino_acids, sheets[row.Sheet]) for row in modification_types]
+    with multiprocessing.Pool(jobs, initializer=_set_reference_index, initargs=(reference_index,)) as pool:
+        for row, (sites, warnings, seconds) in zip(modification_types,
+                                                   pool.imap(_get_modification_sites_timed, pool_jobs)):
+            print("Starting modification", row.Sheet, row.Code, row.Amino_acids)
+            for (category, message) in warnings:
+                metrics.warn(category, message)
+            metrics.add_time('modification_sheets', seconds)
+            yield row.Code, sites
+
+
+def fill_modifications(db_connection, sheets=None, jobs: int = 1) -> None:
+    """Insert modifications of all sheets listed in modifications.csv.
+
+    jobs: number of processes reading and checking the sheets in parallel; the sites are
+    inserted by this process in the order of modifications.csv, so the database is the same
     """
+    # sequences and sources needed for checking modifications are loaded only once
+    reference_index = ReferenceIndex(db_connection)
+    if sheets is None:
+        sheets = load_sheets(get_modification_sheet_names())
+
+    for (modification_type, sites) in _iter_modification_sites(reference_index, sheets, jobs):
+        _insert_modification_sites(db_connection, modification_type, sites)
+
+def _parse_position(position, modification) -> int:
+    if isinstance(position, str) and re.match(r'[a-zA-Z][.-]', position):
+        position = int(position[2:])
+    if not isinstance(position, int):
+        metrics.warn('position_not_int', f"Position {position} not int {modification}")
+        position = int(position)
+    return position
+
+def get_modification_sites(sheet_name, modification_type, allowed_amino_acids,
+                           reference_index, sheets) -> Dict[Tuple[str, int], List[str]]:
+    """Read the valid sites of one modification sheet with their sources.
+
+    Returns a dictionary from (uniprot_id, position) to the list of source ids of the site.
+    Sites are in the order of their first rows in the sheet. A site listed in several rows
+    gets sources from all its rows, in the order of columns, without duplicates.
+    """
+    proteome_sheet = sheets[sheet_name]
 
     all_columns = list(proteome_sheet.columns)
     uniprot_column = 2
@@ -168,50 +393,141 @@ def fill_one_modification(db_connection, sheet_name, modification_type, allowed_
         if not str(column_name).startswith("Unnamed"):
             source_dict[index] = str(column_name).strip()
 
-    for row in tqdm(proteome_sheet.itertuples(name=None), total=len(proteome_sheet), desc='Populating modifications', file=stdout):
-
-        
-        # skip one value in the row, which is the index of the row
-        uniprot_id = str(row[uniprot_column+1]).strip()
-
-        # skip empty positions
-        position = row[site_column+1]
-        if pd.isna(position):
-            print(f"Position missing in row {row[0]} {(uniprot_id, modification_type)}", file=stderr)
-            continue
-        modification = (uniprot_id, position, modification_type)
-
-        if isinstance(position, str) and re.match(r'[a-zA-Z][.-]', position):
-            position = int(position[2:])
-        if not isinstance(position, int):
-            print(f"Position {position} not int {modification}", file=stderr)
-            position = int(position)
-
-        if not has_modifications_on_correct_aminoacids(uniprot_id, allowed_amino_acids, position, modification_type, db_connection):
+    uniprot_ids = proteome_sheet.iloc[:, uniprot_column].astype(str).str.strip()
+
+    # skip empty positions
+    raw_positions = proteome_sheet.iloc[:, site_column]
+    missing = raw_positions.isna()
+    for index in proteome_sheet.index[missing]:
+        metrics.warn('position_missing', f"Position missing in row {index} {(uniprot_ids[index], modification_type)}")
+    uniprot_ids = uniprot_ids[~missing]
+
+    # modification tuples used in messages contain the position as written in the sheet
+    modifications = {index: (uniprot_id, position, modification_type)
+                     for (index, uniprot_id, position)
+                     in zip(uniprot_ids.index, uniprot_ids, raw_positions[~missing].tolist())}
+    positions = pd.Series([_parse_position(modification[1], modification) for modification in modifications.values()],
+                          index=uniprot_ids.index, dtype='int64')
+
+    valid = check_modification_sites(uniprot_ids, positions, allowed_amino_acids,
+                                     modification_type, reference_index)
+    uniprot_ids = uniprot_ids[valid]
+    positions = positions[valid]
+
+    # a site listed in several rows is kept only once, with sources from all its rows
+    sites = {}
+    site_of_row = {}
+    first_row_of_site = {}
+    for (index, site) in zip(uniprot_ids.index, zip(uniprot_ids.tolist(), positions.tolist())):
+        site_of_row[index] = site
+        if site in first_row_of_site:
+            metrics.warn('duplicate_site', f"Duplicate modification {modifications[index]} in row {index}, "
+                                           f"merged with row {first_row_of_site[site]}")
             continue
-
-        try:
-            cursor.execute(sql_query_modifications, (uniprot_id, position, modification_type))
-            last_id = cursor.lastrowid
-        except Exception as e:
-            print(f' did not add modification {modification}.', file=stderr)
-            print(e, file=stderr)
-            continue
-
-        for (column_number, column_name) in source_dict.items():
-            (use_this_ref, ref_id) = process_ref(row[column_number + 1], column_name, modification, cursor)
-        
+        first_row_of_site[site] = index
+        sites[site] = []
+    for (column_number, column_name) in source_dict.items():
+        values = proteome_sheet.iloc[:, column_number][uniprot_ids.index].astype(str).str.strip()
+        # only nonempty cells can be references
+        values = values[(values != "nan") & (values != '')]
+        for (index, value) in values.items():
+            (use_this_ref, ref_id) = process_ref(value, column_name, modifications[index], reference_index.source_ids)
             if use_this_ref:
-                try:
-                    cursor.execute(sql_query_modifications_source, (last_id, ref_id))
-                except Exception as e:
-                    print(f' did not add modification source pair (modification, ref_id)', file=stderr)
-                    print(e, file=stderr)
-
-
-    db_connection.commit()
+                sites[site_of_row[index]].append(ref_id)
+    return {site: list(dict.fromkeys(source_ids)) for (site, source_ids) in sites.items()}
+
+def fill_one_modification(db_connection, sheet_name, modification_type, allowed_amino_acids,
+                          reference_index=None, sheets=None) -> None:
+    if reference_index is None:
+        reference_index = ReferenceIndex(db_connection)
+    if sheets is None:
+        sheets = load_sheets([sheet_name])
+
+    sites = get_modification_sites(sheet_name, modification_type, allowed_amino_acids, reference_index, sheets)
+    _insert_modification_sites(db_connection, modification_type, sites)
+
+def _insert_modification_sites(db_connection, modification_type, sites) -> None:
+    """Insert sites from get_modification_sites with their sources"""
+    # modification ids are assigned here, so that sources can be inserted in bulk as well
+    cursor = db_connection.cursor()
+    cursor.execute(SQL_SELECT_MAX_MODIFICATION_ID)
+    next_id = cursor.fetchone()[0] + 1
+
+    modification_rows = []
+    source_rows = []
+    for (modification_id, (site, source_ids)) in enumerate(sites.items(), next_id):
+        modification_rows.append((modification_id, site[0], site[1], modification_type))
+        source_rows.extend((modification_id, source_id) for source_id in source_ids)
+
+    # all rows of the sheet are inserted in one transaction
+    with metrics.stage('db_insert'), db_connection:
+        cursor.executemany(SQL_INSERT_MODIFICATION, modification_rows)
+        cursor.executemany(SQL_INSERT_MODIFICATION_SOURCE, source_rows)
+    metrics.count('modifications_inserted', len(modification_rows))
+    metrics.count('modification_sources_inserted', len(source_rows))
+    print(f"Inserted {len(modification_rows)} modifications and {len(source_rows)} modification sources")
+
+def update_modifications(db_connection, sheets=None, jobs: int = 1) -> None:
+    """Update modifications and their sources to the modification sheets, without committing.
+
+    Sites which stay in their sheet keep their modification ids, only their changed
+    lists of sources are replaced. New sites get new ids. Sites missing in their sheet,
+    e.g. sites of deleted proteins, and modifications of types no longer listed
+    in modifications.csv are deleted with their sources.
+    jobs: number of processes reading and checking the sheets, as in fill_modifications
+    """
+    reference_index = ReferenceIndex(db_connection)
+    if sheets is None:
+        sheets = load_sheets(get_modification_sheet_names())
 
-def process_ref(value, column_name, modification, cursor):
+    cursor = db_connection.cursor()
+    cursor.execute(SQL_SELECT_MODIFICATIONS)
+    old_modifications = defaultdict(dict)
+    next_id = 1
+    for (modification_id, uniprot_id, position, modification_type) in cursor.fetchall():
+        old_modifications[modification_type][(uniprot_id, position)] = modification_id
+        next_id = max(next_id, modification_id + 1)
+    cursor.execute(SQL_SELECT_MODIFICATION_SOURCES)
+    old_sources = defaultdict(list)
+    for (modification_id, source_id) in cursor.fetchall():
+        old_sources[modification_id].append(source_id)
+
+    modification_rows = []
+    source_rows = []
+    relinked_ids = []
+    deleted_ids = []
+    for (modification_type, sites) in _iter_modification_sites(reference_index, sheets, jobs):
+        old_sites = old_modifications.pop(modification_type, {})
+        for (site, source_ids) in sites.items():
+            modification_id = old_sites.get(site)
+            if modification_id is None:
+                modification_id = next_id
+                next_id += 1
+                modification_rows.append((modification_id, site[0], site[1], modification_type))
+            elif old_sources[modification_id] == source_ids:
+                continue
+            else:
+                relinked_ids.append((modification_id,))
+            source_rows.extend((modification_id, source_id) for source_id in source_ids)
+        deleted_ids.extend((modification_id,) for (site, modification_id) in old_sites.items() if site not in sites)
+    # types which are not in modifications.csv any more
+    for old_sites in old_modifications.values():
+        deleted_ids.extend((modification_id,) for modification_id in old_sites.values())
+
+    with metrics.stage('db_insert'):
+        cursor.executemany(SQL_DELETE_MODIFICATION_SOURCES, deleted_ids + relinked_ids)
+        cursor.executemany(SQL_DELETE_MODIFICATION, deleted_ids)
+        cursor.executemany(SQL_INSERT_MODIFICATION, modification_rows)
+        cursor.executemany(SQL_INSERT_MODIFICATION_SOURCE, source_rows)
+
+    metrics.count('modifications_inserted', len(modification_rows))
+    metrics.count('modifications_relinked', len(relinked_ids))
+    metrics.count('modifications_deleted', len(deleted_ids))
+    metrics.count('modification_sources_inserted', len(source_rows))
+    print(f"Modifications: {len(modification_rows)} inserted, {len(relinked_ids)} with changed sources, "
+          f"{len(deleted_ids)} deleted")
+
+def process_ref(value, column_name, modification, source_ids):
     use_this_ref = False
     value = str(value).strip()
     ref_id = column_name
@@ -225,30 +541,69 @@ def process_ref(value, column_name, modification, cursor):
             use_this_ref = True
             ref_id = value
         else: # print warning
-            print(f"Bad string in reference list {value} for {modification}", file=stderr)
+            metrics.warn('bad_reference_string', f"Bad string in reference list {value} for {modification}")
 
     if use_this_ref:
         # check that ref is valid
-        sql_query = "SELECT source_id FROM mtmod_source WHERE source_id=?"
-        cursor.execute(sql_query, (ref_id,))
-        results = cursor.fetchall()
-        if not results:
-            print(f'did not find {ref_id} from {modification} among sources', file=stderr)
+        if ref_id not in source_ids:
+            metrics.warn('unknown_source', f'did not find {ref_id} from {modification} among sources')
             
     return (use_this_ref, ref_id)
     
 
-def main() -> None:
+def main(profile: int = 0, delta: bool = False, jobs: int = 1) -> None:
+    """Fill the database from the Excel file.
+
+    Timing of the stages and counts of warnings are saved to a report in config.build_report_dir.
+    profile: save cProfile profiles of this number of slowest proteins
+    delta: update an existing database to the Excel file, changing only differing rows
+    jobs: number of processes reading and checking modification sheets in parallel
+    """
+    metrics.start('excel_parser', profile)
+
     # connect to a database
     db_connection = sqlite3.connect(config.database_path)
+
+    # all sheets are read from the Excel file at once
+    with metrics.stage('excel_load'):
+        sheets = load_sheets([PROTEOME_SHEET, SOURCES_SHEET] + get_modification_sheet_names())
     
-    fill_proteins(db_connection)
-    fill_sources(db_connection)
-    fill_modifications(db_connection)
+    if delta:
+        # all changes are committed together, or not at all if an error occurs
+        with db_connection:
+            with metrics.stage('proteins'):
+                update_proteins(db_connection, sheets)
+            with metrics.stage('sources'):
+                update_sources(db_connection, sheets)
+            with metrics.stage('modifications'):
+                update_modifications(db_connection, sheets, jobs)
+    else:
+        with metrics.stage('proteins'):
+            fill_proteins(db_connection, sheets)
+        with metrics.stage('sources'):
+            fill_sources(db_connection, sheets)
+        with metrics.stage('modifications'):
+            fill_modifications(db_connection, sheets, jobs)
+
+    # update statistics used by the query planner
+    with metrics.stage('analyze'):
+        db_connection.execute("ANALYZE")
 
     # close db connection
     db_connection.close()
+    metrics.save()
     
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--profile", dest="profile", type=int, nargs='?', const=10, default=0,
+        help="profile proteins, save profiles of the given number (default 10) of the slowest ones")
+    parser.add_argument(
+        "--delta", dest="delta", action="store_true",
+        help="update an existing database to the Excel file instead of filling an empty one")
+    parser.add_argument(
+        "-j", "--jobs", dest="jobs", type=int, default=1,
+        help="number of processes reading and checking modification sheets in parallel")
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,50 @@
+"""Loading of sheets from the Excel file with PTM data.
+
+All sheets needed by excel_parser.py are read in one pass over the workbook.
+Parsed sheets are cached in a pickle file named by the hash of the Excel file,
+so that repeated runs on an unchanged workbook skip parsing Excel entirely."""
+
+import glob
+import os
+import pickle
+from sys import stderr
+from typing import Dict, Iterable
+
+import pandas as pd
+
+import config
+from build_manifest import get_file_digest
+
+
+def load_sheets(
+        sheet_names: Iterable[str],
+        excel_path: str = config.excel_path,
+        cache_dir: str = config.excel_cache_dir
+) -> Dict[str, pd.DataFrame]:
+    """Return a dictionary of DataFrames with the given sheets of the workbook"""
+    sheet_names = list(dict.fromkeys(sheet_names))
+    cache_path = os.path.join(cache_dir, f'{get_file_digest(excel_path)}.pkl')
+
+    sheets = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            sheets = pickle.load(f)
+    missing_names = [name for name in sheet_names if name not in sheets]
+    if not missing_names:
+        return {name: sheets[name] for name in sheet_names}
+
+    # pandas opens the workbook only once for all sheets in the list
+    print(f'Parsing {len(missing_names)} sheets of {excel_path}', file=stderr)
+    sheets.update(pd.read_excel(excel_path, sheet_name=missing_names))
+
+    # cache files of older versions of the workbook are removed
+    os.makedirs(cache_dir, exist_ok=True)
+    for old_cache_path in glob.glob(os.path.join(cache_dir, '*.pkl')):
+        if old_cache_path != cache_path:
+            os.remove(old_cache_path)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(sheets, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+    return {name: sheets[name] for name in sheet_names}
@@ -1,84 +1,37 @@
 """Script generating website for individual proteins as well as the main page.
 It uses the SQLite database of proteins and modifications."""
 
-import subprocess
 from tqdm import tqdm
 import os
 import sys
-from typing import List, Tuple
 import json
-import sqlite3
 import shutil
 import argparse
 import inspect
+import glob
+import hashlib
 
 import jinja2
 import markupsafe
 import pandas as pd
 
 import config
+from db_access import get_all_uniprot_ids, get_protein_info, get_modification_counts, \
+        get_modifications_with_sources
+from structure_renderer import StructureRenderer
+from structure_cache import StructureCache
+from build_manifest import BuildManifest, get_file_digest, get_files_digest, get_data_digest
+from page_writer import COMPRESSIONS, write_page, write_file
+from search_index import get_search_index_json
+from data_export import write_api
+from structure_neighbors import NEIGHBOR_RADIUS, NeighborhoodStore
+from build_metrics import metrics
 
+# directory of structure files in the website
+STRUCTURES_DIR = "structures"
 
-def get_all_uniprot_ids() -> List[str]:
-        cnx = create_context()
-        cursor = cnx.cursor()
-        cursor.execute("SELECT DISTINCT uniprot_id FROM mtmod_proteins")
-        uniprot_ids = [row[0] for row in cursor]
-        return uniprot_ids
-
-def get_protein_info():
-        cnx = create_context()
-        cnx.row_factory = sqlite3.Row
-        cursor = cnx.cursor()
-        cursor.execute(
-                "SELECT uniprot_id, protein_name, systematic_gene_name, standard_gene_name, gene_names, description, protein_sequence, mapping "
-                "FROM mtmod_proteins ORDER BY uniprot_id"
-        )
-
-        # get all rows to a dictionary with uniprot_id as key
-        result = {row['uniprot_id']:dict(row) for row in cursor}
-        
-        # fix mapping, compute protein length
-        for id, row in result.items():
-                if row['mapping'] is not None:
-                        row['mapping'] = json.loads(row['mapping'])
-                row['length'] = len(row['protein_sequence'])
-                
-        return result
-
-def get_modification_counts(protein_info, modification_list):
-        """Add modification counts to protein_info"""
-        
-        cnx = create_context()
-        cursor = cnx.cursor()
-        cursor.execute(
-                "SELECT COUNT(*),uniprot_id, modification_type FROM mtmod_modifications GROUP BY uniprot_id, modification_type"
-                )
-
-        count_dict = {(row[1], row[2]):row[0] for row in cursor}
-        for uniprot_id, row in protein_info.items():
-                for mod_record in modification_list:
-                        mod_type =  mod_record["Code"]
-                        key = (uniprot_id, mod_type)
-                        if key in count_dict:
-                                row[mod_type] = count_dict[key]
-                        else:
-                                row[mod_type] = 0
-        
-
-def get_modifications_for_protein(protein_id) -> List[Tuple[int, str, int]]:
-        cnx = create_context()
-        cursor = cnx.cursor()
-        cursor.execute("SELECT position, modification_type, modification_id FROM mtmod_modifications "
-                       "WHERE uniprot_id = ? ORDER BY position", (protein_id,)
-        )
-        uniprot_modifications = cursor.fetchall()
-        return uniprot_modifications
-
-
-def create_context():
-        # connect to a database
-        return sqlite3.connect(config.database_path)
+# records of pdb files needed by GLmol, other records are removed with --strip-pdb
+GLMOL_PDB_RECORDS = ("ATOM", "HETATM", "TER", "HELIX", "SHEET", "CONECT", "END")
 
 
 def get_jinja_template(filename):
@@ -89,53 +42,118 @@ def get_jinja_template(filename):
         return environment.get_template(filename)
         
 
-def get_sources_for_modification_id(
-        modification_id
-) -> List[Tuple[str, str]]:
-        cnx = create_context()
-        cursor = cnx.cursor()
-        cursor.execute(
-                "SELECT source_id FROM mtmod_modification_source WHERE modification_id = ?", (modification_id,)
-        )
-        source_ids = cursor.fetchall()
-        sources = []
-        for source_id in source_ids:
-                cursor.execute(
-                        "SELECT source_description, source_url FROM mtmod_source WHERE source_id = ?", (source_id[0],)
-                )
-                sources.extend(cursor.fetchall())
-        return sources
+def render_sequence_html(sequence, sites, modification_df):
+        """HTML of a protein sequence with highlighted modifications, built in one pass.
+
+        Residues are split into blocks of 10 separated by spaces, with 50 residues per line.
+        sites: list of (0-indexed position, modification code, text of tooltip) sorted by position
+        """
+        text_colors = modification_df["Text_color"].to_dict()
+        colors = modification_df["Color"].to_dict()
+
+        parts = []
+        next_site = 0
+        for start in range(0, len(sequence), 10):
+                end = min(start + 10, len(sequence))
+                last = start
+                while next_site < len(sites) and sites[next_site][0] < end:
+                        pos, pos_type, modification_type = sites[next_site]
+                        parts.append(sequence[last:pos])
+                        parts.append(
+                                f'<a href="#source{pos + 1}_1" data-bs-toggle="tooltip" data-bs-placement="top" title="{pos + 1}, {modification_type}">'
+                                f'<span style="color: {text_colors[pos_type]}; '
+                                f'background-color:{colors[pos_type]}">'
+                                f'{sequence[pos]}</span></a>'
+                        )
+                        last = pos + 1
+                        next_site += 1
+                parts.append(sequence[last:end])
+                if end - start == 10:
+                        parts.append(" <br/>" if end % 50 == 0 else " ")
+        return markupsafe.Markup("".join(parts))
+
+
+def get_neighborhoods(protein_info, modifications, store):
+        """Neighborhoods of modification sites of a protein from a NeighborhoodStore, by residue number.
+
+        Empty for proteins without a structure and proteins with less than two sites in the structure.
+        modifications: list of modifications of the protein as returned by get_modifications_with_sources
+        """
+        uniprot_id = protein_info["uniprot_id"]
+        mapping = protein_info["mapping"]
+        if mapping is None or not os.path.exists(f"{config.pdb_file_prefix}/{uniprot_id}.pdb"):
+                return {}
+        site_residues = {mapping[pos - 1] + 1 for pos, *_ in modifications if mapping[pos - 1] != -1}
+        if len(site_residues) < 2:
+                return {}
+        return store.get(uniprot_id, site_residues)
 
 
+def get_close_modifications(sequence, mapping, sites, neighborhoods):
+        """Rows of the table of modifications close to each other in the structure of a protein.
 
-def create_protein_page(protein_info, verbose, modification_df):
+        sites: list of (0-indexed position, modification code, text of tooltip) sorted by position
+        neighborhoods: neighborhoods of the sites returned by get_neighborhoods
+        Each row is a site with other sites within NEIGHBOR_RADIUS, ordered by distance,
+        and with labels (like K42) of all residues within NEIGHBOR_RADIUS.
+        """
+        # 0-indexed positions in the sequence of residue numbers of the structure
+        positions = {residue + 1: pos for pos, residue in enumerate(mapping) if residue != -1}
+        sites_at_position = {site[0]: site for site in sites}
+
+        rows = []
+        for pos, pos_type, modification_type in sites:
+                if mapping[pos] == -1 or mapping[pos] + 1 not in neighborhoods:
+                        continue
+                residues, close_sites = neighborhoods[mapping[pos] + 1]
+                if not close_sites:
+                        continue
+                close = [sites_at_position[positions[residue]] + (distance,) for residue, distance in close_sites]
+                rows.append({'pos': pos, 'type': pos_type, 'modification_type': modification_type,
+                             'close': [{'pos': close_pos, 'type': close_type, 'modification_type': close_modification_type,
+                                        'distance': round(distance, 1)}
+                                       for close_pos, close_type, close_modification_type, distance in close],
+                             'residues': [f"{sequence[positions[residue]]}{positions[residue] + 1}"
+                                          for residue in residues if residue in positions]})
+        return rows
+
+
+def prepare_protein_page(protein_info, verbose, modification_df, modifications=None, neighborhoods=None):
+        """Collect data for the page of one protein.
+
+        Returns a dictionary with template variables of the page and, if the protein
+        has a 3D structure, the list of residues to be colored in the structure.
+        modifications: list of modifications of this protein with their sources
+        as returned by get_modifications_with_sources, loaded if not given
+        neighborhoods: neighborhoods of modification sites returned by get_neighborhoods,
+        looked up in the NeighborhoodStore if not given
+        """
         uniprot_id = protein_info["uniprot_id"]
-        modifications = get_modifications_for_protein(uniprot_id)
+        if modifications is None:
+                modifications = get_modifications_with_sources(uniprot_id).get(uniprot_id, [])
         
         mapping = protein_info["mapping"]
                 
         sources = []
-        positions2d = []
         positions3d = []
-        multiple = {}
-
-        # 1-indexed to 0-indexed
-        positions = [mod[0] - 1 for mod in modifications]
-        for pos, pos_type, mod_id in modifications:
+        # modification types at each 0-indexed position, in the order of modifications
+        types_at_position = {}
+        for pos, pos_type, mod_id, mod_sources in modifications:
                 pos -= 1
-                mod_sources = get_sources_for_modification_id(mod_id)
                 for source_name, source_url in mod_sources:
                         sources.append({'name':source_name, 'url':source_url,
                                         'pos':pos, 'type':pos_type})
-                if positions.count(pos) > 1:
-                        if pos in multiple:
-                           multiple[pos].append(pos_type)
-                        else:
-                           multiple[pos] = [pos_type]
-                        pos_type = "multiple"
-                positions2d.append((pos, pos_type))
+                types_at_position.setdefault(pos, []).append(pos_type)
+
+        # positions with more than one modification are shown as multiple
+        sites = []
+        for pos, pos_types in sorted(types_at_position.items()):
+                if len(pos_types) > 1:
+                        sites.append((pos, "multiple", " ".join(pos_types)))
+                else:
+                        sites.append((pos, pos_types[0], pos_types[0]))
                 if mapping is not None and mapping[pos] != -1:
-                        positions3d.append((mapping[pos], pos_type))
+                        positions3d.extend([(mapping[pos], sites[-1][1])] * len(pos_types))
 
         # sort and add to each source its order within the same position
         sources.sort(key=lambda x: x["pos"])
@@ -150,79 +168,131 @@ def create_protein_page(protein_info, verbose, modification_df):
                         
 
         different_modifications = []
-        single_chars = list(protein_info['protein_sequence'])
-        for pos, pos_type in positions2d:
-                modification_type = pos_type
-                if pos in multiple:
-                    modification_type = " ".join(multiple[pos])
-                single_chars[pos] = (
-                        # f'<div class="tooltip"><span style="color: {modification_df.loc[pos_type,"Text_color"]}; '
-                        # f'background-color:{modification_df.loc[pos_type,"Color"]}">{single_chars[pos]}</span>'
-                        # f'<span class="tooltiptext">{pos + 1}, {pos_type}</span></div>'
-
-                         f'<a href="#source{pos + 1}_1" data-bs-toggle="tooltip" data-bs-placement="top" title="{pos + 1}, {modification_type}">'
-                         f'<span style="color: {modification_df.loc[pos_type,"Text_color"]}; '
-                         f'background-color:{modification_df.loc[pos_type,"Color"]}">'
-                         f'{single_chars[pos]}</span></a>'
-
-                )
+        for pos, pos_type, modification_type in sites:
                 if pos_type not in different_modifications:
                         different_modifications.append(pos_type)
+        sequence_html = render_sequence_html(protein_info['protein_sequence'], sites, modification_df)
         
         hasStructure = True
+        colored_residues = None
         if not os.path.exists(f"{config.pdb_file_prefix}/{uniprot_id}.pdb"):
-                print(
-                        "Structure with uniprot_id",
-                        uniprot_id,
-                        "not in 3d_structures folder. Will generate page without 3d structure.", file=sys.stderr
-                )
+                metrics.warn('structure_missing',
+                             f"Structure with uniprot_id {uniprot_id} not in 3d_structures folder. "
+                             "Will generate page without 3d structure.")
                 hasStructure = False
-                template = get_jinja_template("protein_page.html")
-                with open(f"{config.web_output_dir}/{uniprot_id}.html", "w") as text_file:
-                        print(template.render(protein_info = protein_info,
-                                single_chars = single_chars,
-                                sources = sources,
-                                hasStructure = hasStructure,
-                                modifications = different_modifications,
-                                modification_df = modification_df ), file = text_file)
-                return
-
-        
-        script = f"pymol -c pymol_script.pml -- ../{config.pdb_file_prefix}"
-        script += " {}"
-        for _ in positions3d:
-                script += " {}"
-
-        pos3d_str = []
-        for pos, pos_type in positions3d:
-                pos3d_str.append(f'{pos+1}."{modification_df.loc[pos_type,"Color"]}"')
-
-        script = script.format(uniprot_id, *pos3d_str)
-
-        if verbose:
-                print("Printing the generated pymol script...")
-                print(script)
         else:
-                script += " > /dev/null"
-
-        subprocess.call(script, shell=True, cwd="pdb_to_html")
+                colored_residues = [(pos + 1, modification_df.loc[pos_type, "Color"]) for pos, pos_type in positions3d]
+                if verbose:
+                        print("Rendering structure", uniprot_id, "with colored residues", colored_residues)
+
+        close_modifications = []
+        if hasStructure and mapping is not None:
+                if neighborhoods is None:
+                        with NeighborhoodStore() as store:
+                                neighborhoods = get_neighborhoods(protein_info, modifications, store)
+                close_modifications = get_close_modifications(protein_info['protein_sequence'], mapping, sites,
+                                                              neighborhoods)
+
+        return {'protein_info': protein_info,
+                'sequence_html': sequence_html,
+                'sources': sources,
+                'hasStructure': hasStructure,
+                'modifications': different_modifications,
+                'modification_df': modification_df,
+                'colored_residues': colored_residues,
+                'close_modifications': close_modifications}
+
+
+def strip_pdb_records(pdb_file):
+        """Keep only records of a pdb file which are used by GLmol"""
+        return "".join(line for line in pdb_file.splitlines(keepends=True) if line.startswith(GLMOL_PDB_RECORDS))
+
+
+def write_structure_files(uniprot_id, pdb_file=None, representation=None, compress=(), strip=False):
+        """Write the structure of a protein page to files fetched by the page, return their urls.
+
+        File names contain a hash of their content, so that browsers can keep them in cache
+        until they change. Older files of the protein are removed; without pdb_file all are removed.
+        strip: remove records of the pdb file not used by GLmol
+        """
+        directory = f"{config.web_output_dir}/{STRUCTURES_DIR}"
+        os.makedirs(directory, exist_ok=True)
+        if pdb_file is not None and strip:
+                pdb_file = strip_pdb_records(pdb_file)
+
+        urls = {}
+        if pdb_file is not None:
+                for suffix, text in (("pdb", pdb_file), ("rep", representation)):
+                        data = text.encode()
+                        urls[suffix] = f"{STRUCTURES_DIR}/{uniprot_id}.{hashlib.sha256(data).hexdigest()[:16]}.{suffix}"
+                        write_file(f"{config.web_output_dir}/{urls[suffix]}", data, compress)
+
+        current = [f"{config.web_output_dir}/{url}" for url in urls.values()]
+        for path in glob.glob(f"{directory}/{uniprot_id}.*"):
+                if not any(path == url or path.startswith(url + ".") for url in current):
+                        os.remove(path)
+        return urls
+
+
+def write_protein_page(page, pdb_file=None, representation=None, compress=(), strip_pdb=False):
+        """Write page prepared by prepare_protein_page, with a rendered structure if it has one.
+
+        The structure is written to separate files, which the page fetches when it is viewed.
+        compress: formats of compressed copies of the page, see page_writer.COMPRESSIONS
+        strip_pdb: remove records of the pdb file not used by GLmol
+        """
+        uniprot_id = page['protein_info']['uniprot_id']
+        structure_urls = write_structure_files(uniprot_id, pdb_file, representation, compress, strip_pdb)
+        template = get_jinja_template("protein_page.html")
+        write_page(template, f"{config.web_output_dir}/{uniprot_id}.html", compress,
+                   protein_info = page['protein_info'],
+                   sequence_html = page['sequence_html'],
+                   sources = page['sources'],
+                   hasStructure = page['hasStructure'],
+                   structure_urls = structure_urls,
+                   modifications = page['modifications'],
+                   modification_df = page['modification_df'],
+                   close_modifications = page['close_modifications'],
+                   neighbor_radius = NEIGHBOR_RADIUS)
+
+
+def get_build_inputs_digest():
+        """Hash of inputs shared by all protein pages: templates, modification settings and structure export"""
+        paths = glob.glob("templates/*") + [config.modifications_csv_path,
+                                             "pdb_to_html/pymol2glmol.py", "structure_renderer.py"]
+        return get_files_digest(paths)
+
+
+def get_page_digest(page, build_inputs_digest):
+        """Hash of all inputs of a page prepared by prepare_protein_page"""
+        data = {key: value for key, value in page.items() if key != 'modification_df'}
+        data['build_inputs'] = build_inputs_digest
+        if page['hasStructure']:
+                data['pdb_file'] = get_file_digest(f"{config.pdb_file_prefix}/{page['protein_info']['uniprot_id']}.pdb")
+        return get_data_digest(data)
+
+
+def create_protein_page(protein_info, verbose, modification_df, renderer):
+        page = prepare_protein_page(protein_info, verbose, modification_df)
+        if not page['hasStructure']:
+                write_protein_page(page)
+                return
+        pdb_file, representation = renderer.render(protein_info['uniprot_id'], page['colored_residues'])
+        write_protein_page(page, pdb_file, representation)
 
-        with open("./pdb_to_html/representation.txt", 'r') as file:
-                representation = file.read()
 
-        with open("./pdb_to_html/pdb_file.txt", 'r') as file:
-                pdb_file = file.read()
+def get_database_table_json(protein_list, modification_list):
+        """Data of the protein table of database.html, rendered by web_include/database_table.js
 
-        template = get_jinja_template("protein_page.html")
-        with open(f"{config.web_output_dir}/{uniprot_id}.html", "w") as text_file:
-                print(template.render(protein_info = protein_info,
-                                single_chars = single_chars,
-                                sources = sources,
-                                hasStructure = hasStructure,
-                                pdb_file = pdb_file,
-                                representation = representation,
-                                modifications = different_modifications,
-                                modification_df = modification_df ), file = text_file)
+        proteins: uniprot_id, systematic gene name, protein name, gene names and length of each protein
+        modifications: codes of modifications
+        counts: for each modification its counts in all proteins, in the order of proteins
+        """
+        table = {'proteins': [[item["uniprot_id"], item["systematic_gene_name"], item["protein_name"],
+                               item["gene_names"], item["length"]] for item in protein_list],
+                 'modifications': [moditem["Code"] for moditem in modification_list],
+                 'counts': [[item[moditem["Code"]] for item in protein_list] for moditem in modification_list]}
+        return json.dumps(table, separators=(',', ':'))
 
 
 def get_modification_list(modification_df):
@@ -235,17 +305,27 @@ def get_modification_list(modification_df):
 
                 
 
-def main(verbose=False, debug=False):
+def main(verbose=False, debug=False, jobs=1, force=False, compress=(), strip_pdb=False, profile=0, parquet=False):
         """build index.html, database.html and protein pages
         
-        verbose: print scripts fr indovidual proteins
+        verbose: print structure coloring for individual proteins
         debug: consider only proteins P31380 P00360 P18963 A5Z2X5
+        jobs: number of parallel PyMOL processes rendering structures
+        force: rebuild all protein pages, even those unchanged since the last build
+        compress: formats (gz, br) of compressed copies written next to each page and structure
+        strip_pdb: remove records of pdb files not used by GLmol from the structure files
+        profile: save cProfile profiles of this number of slowest page renders and writes
+        parquet: also write the bulk exports of the JSON API in parquet format
+
+        Timing of the stages and counts of warnings are saved to a report in config.build_report_dir.
         """
         
         print('Building protein browser...')
+        metrics.start('html_builder', profile)
 
 
-        uniprot_ids = get_all_uniprot_ids()
+        with metrics.stage('load_db'):
+                uniprot_ids = get_all_uniprot_ids()
         if len(uniprot_ids) == 0:
                 print("Error: no uniprot ids loaded from database!", file=sys.stderr)
                 exit(1)
@@ -254,32 +334,50 @@ def main(verbose=False, debug=False):
         modification_df.set_index('Code', inplace=True)
                 
         modification_list = get_modification_list(modification_df)
-        protein_info = get_protein_info()
-        get_modification_counts(protein_info, modification_list)
+        with metrics.stage('load_db'):
+                protein_info = get_protein_info()
+                get_modification_counts(protein_info, modification_list)
                 
         if not os.path.exists(config.pdb_file_prefix):
                 print(f"Error: could not find folder {config.pdb_file_prefix}!", file=sys.stderr)
                 exit(1)
 
-        if not os.path.exists("pdb_to_html"):
-                print("Error: could not find folder pdb_to_html containing script!", file=sys.stderr)
-                exit(1)
-                
         if not os.path.exists(config.web_output_dir):
                 os.makedirs(config.web_output_dir)
 
+        if 'br' in compress:
+                try:
+                        import brotli
+                except ImportError:
+                        print("Error: brotli compression requires the brotli package!", file=sys.stderr)
+                        exit(1)
+        if parquet:
+                try:
+                        import pyarrow
+                except ImportError:
+                        print("Error: parquet export requires the pyarrow package!", file=sys.stderr)
+                        exit(1)
+
 
         protein_list = [protein_info[uniprot_id] for uniprot_id in uniprot_ids]
 
-        template = get_jinja_template("index.html")
-        with open(f"./{config.web_output_dir}/index.html", "w") as text_file:
-                print(template.render(protein_list=protein_list), file=text_file)
+        with metrics.stage('main_pages'):
+                template = get_jinja_template("index.html")
+                write_page(template, f"./{config.web_output_dir}/index.html", compress)
+                # the search box of index.html loads the search index when the page is shown
+                write_file(f"./{config.web_output_dir}/search_index.json", get_search_index_json(protein_list).encode(), compress)
 
-        template = get_jinja_template("database.html")
-        with open(f"./{config.web_output_dir}/database.html", "w") as text_file:
-                print(template.render(protein_list=protein_list, modification_list = modification_list), file=text_file)
+                template = get_jinja_template("database.html")
+                write_page(template, f"./{config.web_output_dir}/database.html", compress,
+                           modification_list = modification_list)
+                write_file(f"./{config.web_output_dir}/database.json",
+                           get_database_table_json(protein_list, modification_list).encode(), compress)
 
-        shutil.copytree("web_include", f"{config.web_output_dir}/include", dirs_exist_ok=True)
+                shutil.copytree("web_include", f"{config.web_output_dir}/include", dirs_exist_ok=True)
+
+        # JSON files of proteins and bulk exports for downstream analyses
+        with metrics.stage('api'):
+                metrics.count('api_files_written', write_api(config.web_output_dir, modification_df, compress, parquet))
                 
         if debug: # only several proteins
                 pages_todo = ["P31380", "P00360", "P18963", "A5Z2X5"]
@@ -287,8 +385,67 @@ def main(verbose=False, debug=False):
                 # not debug - do all proteins
                 pages_todo = uniprot_ids
                 
-        for uniprot_id in tqdm(pages_todo,  desc='Uniprot IDs', file=sys.stdout):
-                create_protein_page(protein_info[uniprot_id], verbose, modification_df)
+        # modifications and sources of all proteins are read from the database at once
+        with metrics.stage('load_db'):
+                modifications = get_modifications_with_sources()
+
+        # neighborhoods of sites in the structures are computed only for structures or sites changed
+        # since the last build, the others are read from the store
+        neighborhoods = {}
+        with metrics.stage('neighborhoods'), NeighborhoodStore() as store:
+                for uniprot_id in pages_todo:
+                        neighborhoods[uniprot_id] = get_neighborhoods(protein_info[uniprot_id],
+                                                                      modifications.get(uniprot_id, []), store)
+                metrics.count('neighborhoods_computed', store.computed)
+
+        pages = []
+        for uniprot_id in pages_todo:
+                with metrics.stage('render', uniprot_id), metrics.profiled(uniprot_id, 'render'):
+                        pages.append(prepare_protein_page(protein_info[uniprot_id], verbose, modification_df,
+                                                          modifications.get(uniprot_id, []),
+                                                          neighborhoods[uniprot_id]))
+
+        # skip pages whose inputs did not change since the last build
+        manifest = BuildManifest(config.build_manifest_path)
+        # pages built with other options for written files are rebuilt as well
+        build_inputs_digest = get_data_digest([get_build_inputs_digest(), sorted(compress), strip_pdb])
+        page_digests = {}
+        changed_pages = []
+        with metrics.stage('manifest'):
+                for page in pages:
+                        filename = f"{page['protein_info']['uniprot_id']}.html"
+                        page_digests[filename] = get_page_digest(page, build_inputs_digest)
+                        if force or not manifest.is_current(filename, page_digests[filename]):
+                                changed_pages.append(page)
+        print(f"Skipping {len(pages) - len(changed_pages)} unchanged protein pages, "
+              f"building {len(changed_pages)} pages")
+        metrics.count('pages_skipped', len(pages) - len(changed_pages))
+        metrics.count('pages_built', len(changed_pages))
+        pages = changed_pages
+
+        # structures are rendered by parallel workers, results arrive in the order of pages
+        structure_jobs = [(page['protein_info']['uniprot_id'], page['colored_residues'])
+                          for page in pages if page['hasStructure']]
+        with StructureCache() as cache, StructureRenderer(jobs) as renderer:
+                structures = cache.imap(renderer, structure_jobs)
+                for page in tqdm(pages,  desc='Uniprot IDs', file=sys.stdout):
+                        uniprot_id = page['protein_info']['uniprot_id']
+                        if page['hasStructure']:
+                                # time of waiting for the structure from the cache or PyMOL workers
+                                with metrics.stage('structure_wait', uniprot_id):
+                                        structure = next(structures)
+                                with metrics.stage('write', uniprot_id), metrics.profiled(uniprot_id, 'write'):
+                                        write_protein_page(page, *structure, compress=compress, strip_pdb=strip_pdb)
+                        else:
+                                with metrics.stage('write', uniprot_id), metrics.profiled(uniprot_id, 'write'):
+                                        write_protein_page(page, compress=compress)
+                        filename = f"{uniprot_id}.html"
+                        manifest.update(filename, page_digests[filename])
+                print(f"Structures taken from cache: {cache.hits}, rendered by PyMOL: {cache.misses}")
+                metrics.count('structures_cached', cache.hits)
+                metrics.count('structures_rendered', cache.misses)
+        manifest.save()
+        metrics.save()
 
 
 
@@ -298,5 +455,17 @@ if __name__ == "__main__":
                 "-v", dest="verbose",  action='store_true')
         parser.add_argument(
                 "-d", dest="debug",  action='store_true')
+        parser.add_argument(
+                "-j", "--jobs", dest="jobs", type=int, default=1)
+        parser.add_argument(
+                "-f", "--force", dest="force",  action='store_true')
+        parser.add_argument(
+                "-c", "--compress", dest="compress", nargs='+', default=[], choices=list(COMPRESSIONS))
+        parser.add_argument(
+                "--strip-pdb", dest="strip_pdb",  action='store_true')
+        parser.add_argument(
+                "--profile", dest="profile", type=int, nargs='?', const=10, default=0)
+        parser.add_argument(
+                "--parquet", dest="parquet",  action='store_true')
         args = parser.parse_args()
         main(** vars(args))
@@ -0,0 +1,16 @@
+/* Adds indexes from create_db.sql to a database created by an older version of create_db.sql.
+   Fails on idx_modifications_site if the database contains duplicate modifications,
+   these need to be removed first (e.g. by rebuilding the database with excel_parser.py). */
+
+CREATE UNIQUE INDEX IF NOT EXISTS `idx_modifications_site`
+  ON mtmod_modifications (`uniprot_id`, `position`, `modification_type`);
+
+CREATE INDEX IF NOT EXISTS `idx_modifications_type`
+  ON mtmod_modifications (`uniprot_id`, `modification_type`);
+
+CREATE INDEX IF NOT EXISTS `idx_modification_source`
+  ON mtmod_modification_source (`modification_id`, `source_id`);
+
+PRAGMA journal_mode = WAL;
+
+ANALYZE;
@@ -0,0 +1,119 @@
+"""Streaming writer of generated web pages and other files of the website.
+
+A template is rendered piece by piece by template.generate() and each piece is written
+to the page file right away, so the whole page is never held in memory.
+Optionally the same pieces are compressed into .gz and .br siblings of the page
+(e.g. P00360.html.gz), which a static web server can send to browsers
+without compressing the page on each request. Other files, such as structures
+fetched by the protein pages, can be written with their compressed copies as well."""
+
+import gzip
+import os
+
+# compression formats which can be requested, mapped to file suffixes
+COMPRESSIONS = {'gz': '.gz', 'br': '.br'}
+
+# size of text collected from the template before it is written and compressed
+BUFFER_SIZE = 64 * 1024
+
+
+class _BrotliFile:
+        """File object compressing written bytes with brotli"""
+
+        def __init__(self, path):
+                import brotli
+                self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=11)
+                self._file = open(path, "wb")
+
+        def write(self, data):
+                self._file.write(self._compressor.process(data))
+
+        def close(self):
+                self._file.write(self._compressor.finish())
+                self._file.close()
+
+
+def _open_compressed(path, compression):
+        if compression == 'gz':
+                # mtime=0 makes the output identical for identical pages
+                return gzip.GzipFile(path, "wb", compresslevel=9, mtime=0)
+        return _BrotliFile(path)
+
+
+def _open_outputs(path, compress):
+        """Open the file path and its compressed copies, remove copies which are not requested"""
+        outputs = [open(path, "wb")]
+        try:
+                for compression, suffix in COMPRESSIONS.items():
+                        if compression in compress:
+                                outputs.append(_open_compressed(path + suffix, compression))
+                        elif os.path.exists(path + suffix):
+                                os.remove(path + suffix)
+        except:
+                for output in outputs:
+                        output.close()
+                raise
+        return outputs
+
+
+class StreamWriter:
+        """Text file written in pieces, together with its compressed copies.
+
+        Written text is collected up to BUFFER_SIZE before it is encoded and written.
+        """
+
+        def __init__(self, path, compress=()):
+                self._outputs = _open_outputs(path, compress)
+                self._buffer = []
+                self._size = 0
+
+        def write(self, text):
+                self._buffer.append(text)
+                self._size += len(text)
+                if self._size >= BUFFER_SIZE:
+                        self.flush()
+
+        def flush(self):
+                data = "".join(self._buffer).encode()
+                for output in self._outputs:
+                        output.write(data)
+                self._buffer = []
+                self._size = 0
+
+        def close(self):
+                try:
+                        self.flush()
+                finally:
+                        for output in self._outputs:
+                                output.close()
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, *args):
+                self.close()
+
+
+def write_page(template, path, compress=(), **context):
+        """Render template with context to the file path, streaming it in pieces.
+
+        compress: formats from COMPRESSIONS, for each a compressed copy of the page is written
+        next to it; compressed copies of formats which are not requested are removed,
+        so that a web server does not serve an outdated page
+        """
+        with StreamWriter(path, compress) as writer:
+                for piece in template.generate(**context):
+                        writer.write(piece)
+                # the final newline matches pages written by print()
+                writer.write("\n")
+
+
+def write_file(path, data, compress=()):
+        """Write bytes to the file path and its compressed copies, see write_page"""
+        outputs = _open_outputs(path, compress)
+        try:
+                for output in outputs:
+                        output.write(data)
+        finally:
+                for output in outputs:
+                        output.close()
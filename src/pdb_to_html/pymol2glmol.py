@@ -4,12 +4,18 @@ Written by biochem_fan, 2011
 
 Modified by y-mtPTM authors to print 
 results to two text files rather than 
-include in an HTML file.
+include in an HTML file. Function get_rep
+returns the same results as strings and
+can be used with any PyMOL instance.
+With compact=True it returns the representation
+in the compact JSON format read by
+GLmol.parseCompactRep in glmol.js.
 '''
 
 from pymol import cmd
 from math import cos, sin, pi, sqrt, acos, asin, atan2
 import os
+import json
 
 
 def compactSeq(seq):
@@ -34,9 +40,8 @@ def compactSeq(seq):
     return ','.join(ret)
 
 
-def parseObjMol(obj):
+def parseObjMol(obj, _self=cmd):
     name = obj[0]
-    ids = []
     sphere = []
     trace = []
     ribbon = []
@@ -74,14 +79,12 @@ def parseObjMol(obj):
         if (ss == 'H'):
             helix.append(serial)
 
-        c = cmd.get_color_tuple(atom[21])
+        c = _self.get_color_tuple(atom[21])
         if (not c in colors):
             colors[c] = []
         colors[c].append(serial)
-        ids.append("ID %d is %s in resi %s %s at chain %s"\
-                   % (atom[22], atom[6], atom[3], atom[5], atom[1]))
 
-    for c in colors.keys():  # TODO: better compression
+    for c in colors.keys():
         colors[c] = compactSeq(colors[c])
 
     ret = ''
@@ -100,7 +103,7 @@ def parseObjMol(obj):
     return ret
 
 
-def parseDistObj(obj):
+def parseDistObj(obj, _self=cmd):
     if (obj[5][0][3][10] != 1):  # 'show dashed' flag
         return ""
     N = obj[5][2][0][0]
@@ -108,18 +111,127 @@ def parseDistObj(obj):
     ret = []
     for p in points:
         ret.append("%.3f" % p)
-    color = cmd.get_color_tuple(obj[5][0][2])
+    color = _self.get_color_tuple(obj[5][0][2])
     return "\ndists:%.3f,%.3f,%.3f:" % color + ','.join(ret)
 
 
-def dump_rep(name):
+def compactRanges(seq):
+    """Delta encoded ranges of sorted atom serials for the compact format.
+
+    Flat list of pairs (gap, length), where gap is the distance of the range start
+    from the end of the previous range (from 0 for the first range).
+    """
+    ret = []
+    end = 0
+    i = 0
+    while i < len(seq):
+        start = seq[i]
+        while i + 1 < len(seq) and seq[i + 1] == seq[i] + 1:
+            i += 1
+        ret.append(start - end)
+        ret.append(seq[i] - start + 1)
+        end = seq[i] + 1
+        i += 1
+    return ret
+
+
+def parseObjMolCompact(obj, rep, _self=cmd):
+    """Add representations, secondary structure and colors of object obj to dictionary rep"""
+    # PyMOL representation flags exported for all atoms, bonded atoms and non-bonded atoms
+    flags = [(5, 'ribbon'), (1, 'sphere'), (2, 'surface'), (7, 'line'), (6, 'trace')]
+    flags_bonded = [(0, 'stick')]
+    flags_nonbonded = [(4, 'smallSphere'), (11, 'cross')]
+
+    reps = {key: [] for (_, key) in flags + flags_bonded + flags_nonbonded}
+    ss = {'H': [], 'S': []}
+    color_tuples = {}
+    colors = {}
+    for atom in obj[5][7]:
+        atom_rep = atom[20]
+        serial = atom[22]
+        bonded = (atom[25] == 1)
+        for (i, key) in flags + (flags_bonded if bonded else flags_nonbonded):
+            if i < len(atom_rep) and atom_rep[i] == 1:
+                reps[key].append(serial)
+        if atom[10] in ss:
+            ss[atom[10]].append(serial)
+
+        # colors are converted only once per color index
+        if atom[21] not in color_tuples:
+            r, g, b = _self.get_color_tuple(atom[21])
+            color_tuples[atom[21]] = (int(r * 255) << 16) + (int(g * 255) << 8) + int(b * 255)
+        colors.setdefault(color_tuples[atom[21]], []).append(serial)
+
+    for key, serials in reps.items():
+        if serials:
+            rep['reps'].setdefault(key, []).extend(compactRanges(sorted(serials)))
+    rep['helix'].extend(compactRanges(sorted(ss['H'])))
+    rep['sheet'].extend(compactRanges(sorted(ss['S'])))
+    for c, serials in colors.items():
+        rep['colors'].append([c, compactRanges(sorted(serials))])
+
+
+def parseDistObjCompact(obj, rep, _self=cmd):
+    if (obj[5][0][3][10] != 1):  # 'show dashed' flag
+        return
+    points = obj[5][2][0][1]
+    color = _self.get_color_tuple(obj[5][0][2])
+    rep['dists'].append([[round(c, 3) for c in color], [round(p, 3) for p in points]])
+
+
+def get_view(_self=cmd):
+    """View parameters as in the text format: center, camera z, slab, fog, field of view and rotation"""
+    _self.turn('z', 180)
+    view = _self.get_view()
+    _self.turn('z', 180)
+    cx = -view[12]
+    cy = -view[13]
+    cz = -view[14]
+    cameraZ = - view[11] - 150
+    fov = float(_self.get("field_of_view"))
+    fogStart = float(_self.get("fog_start"))
+    slabNear = view[15] + view[11]
+    slabFar = view[16] + view[11]
+    return [cx, cy, cz, cameraZ, slabNear, slabFar, fogStart, fov] + list(view[:9])
+
+
+def get_bgcolor(_self=cmd):
+    bgcolor = _self.get_setting_tuple('bg_rgb')[1]
+
+    if len(bgcolor) == 1:
+        bgcolor = _self.get_color_tuple(bgcolor[0])
+    return bgcolor
+
+
+def get_rep(name, _self=cmd, compact=False):
+    """Return the PDB string of object name and its GLmol representation.
+
+    compact: return the representation in the compact JSON format instead of the text format
+    """
     try:
-        cmd.set('pse_export_version', 1.74)
+        _self.set('pse_export_version', 1.74)
     except:
         pass
 
-    names = cmd.get_session()['names']
-    cmd.set('pdb_retain_ids', 1)
+    names = _self.get_session()['names']
+    _self.set('pdb_retain_ids', 1)
+
+    if compact:
+        rep = {'reps': {}, 'helix': [], 'sheet': [], 'colors': [], 'dists': []}
+        for obj in names:
+            if (obj == None):
+                continue
+            if (obj[2] == 0):  # not visible
+                continue
+            if (obj[1] == 0 and obj[4] == 1 and obj[0] == name):
+                parseObjMolCompact(obj, rep, _self)
+            if (obj[1] == 0 and obj[4] == 4):  # currently all dist objects are exported
+                parseDistObjCompact(obj, rep, _self)
+        rep['view'] = [round(v, 3) for v in get_view(_self)]
+        bgcolor = get_bgcolor(_self)
+        rep['bgcolor'] = (int(255 * float(bgcolor[0])) << 16) + (int(255 * float(bgcolor[1])) << 8) \
+            + int(255 * float(bgcolor[2]))
+        return _self.get_pdbstr(name), json.dumps(rep, separators=(',', ':'))
 
     ret = ''
     for obj in names:
@@ -128,36 +240,25 @@ def dump_rep(name):
         if (obj[2] == 0):  # not visible
             continue
         if (obj[1] == 0 and obj[4] == 1 and obj[0] == name):
-            ret += parseObjMol(obj)
+            ret += parseObjMol(obj, _self)
         if (obj[1] == 0 and obj[4] == 4):  # currently all dist objects are exported
-            ret += parseDistObj(obj)
-
-    cmd.turn('z', 180)
-    view = cmd.get_view()
-    cmd.turn('z', 180)
-    cx = -view[12]
-    cy = -view[13]
-    cz = -view[14]
-    cameraZ = - view[11] - 150
-    fov = float(cmd.get("field_of_view"))
-    fogStart = float(cmd.get("fog_start"))
-    slabNear = view[15] + view[11]
-    slabFar = view[16] + view[11]
-    ret += "\nview:%.3f,%.3f,%.3f,%.3f,%.3f,%.3f,%.3f,%.3f" % \
-        (cx, cy, cz, cameraZ, slabNear, slabFar, fogStart, fov)
-    for i in range(9):
-        ret += ",%.3f" % view[i]
+            ret += parseDistObj(obj, _self)
 
-    bgcolor = cmd.get_setting_tuple('bg_rgb')[1]
+    ret += "\nview:" + ",".join("%.3f" % v for v in get_view(_self))
 
-    if len(bgcolor) == 1:
-        bgcolor = cmd.get_color_tuple(bgcolor[0])
+    bgcolor = get_bgcolor(_self)
 
     ret += "\nbgcolor:%02x%02x%02x" % (int(255 * float(bgcolor[0])), \
                                        int(255 * float(bgcolor[1])), int(255 * float(bgcolor[2])))
-   
+
+    return _self.get_pdbstr(name), ret
+
+
+def dump_rep(name):
+    pdb_str, ret = get_rep(name)
+
     f = open("pdb_file.txt", "w")
-    f.write(cmd.get_pdbstr(name))
+    f.write(pdb_str)
     f.close()
 
     f = open("representation.txt", "w")
@@ -0,0 +1,348 @@
+"""Queries of modification sites in the SQLite database, from Python or the command line.
+
+Sites of each modification type are kept in a sorted NumPy array of keys combining
+the index of the protein (in the order of uniprot_id) and the position, so that sites
+of a protein, sites in a range of positions and sites near sites of another type are found
+by binary search. The index is built from the database once and cached in
+config.site_index_path; it is rebuilt when the database changes.
+
+Usage examples:
+    # K-acetyl sites within residues 1-50 of proteins with a 3D mapping
+    python3 ptm_query.py sites -t K-acetyl --start 1 --end 50 --with-mapping
+    # proteins with both Phos and Ubi sites, or with Phos sites at most 5 residues from Ubi sites
+    python3 ptm_query.py proteins -t Phos -t Ubi
+    python3 ptm_query.py sites -t Phos -t Ubi --within 5
+    # number of sites of each type, or of each protein and type
+    python3 ptm_query.py count
+    python3 ptm_query.py count -t Phos --by-protein
+Results are written to stdout as they are formatted, as TSV or JSON lines (--format jsonl)."""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterator, List, Sequence
+
+import numpy as np
+
+import config
+
+# keys of sites are protein index << POSITION_BITS | position
+POSITION_BITS = 32
+POSITION_MASK = (1 << POSITION_BITS) - 1
+# number of result rows formatted and written at once
+CHUNK_ROWS = 64 * 1024
+
+
+def _get_database_stamps(database_path: str) -> List[int]:
+    """Size and modification time of the database and its write-ahead log"""
+    stamps = []
+    for path in [database_path, database_path + '-wal']:
+        # readers create an empty write-ahead log, it does not mean a change
+        if os.path.exists(path) and os.stat(path).st_size > 0:
+            stamps.extend([os.stat(path).st_size, os.stat(path).st_mtime_ns])
+        else:
+            stamps.extend([0, 0])
+    return stamps
+
+
+def _get_indices_of_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenation of np.arange(start, end) of all ranges"""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(total, dtype=np.int64) + shifts
+
+
+class SiteIndex:
+    """Sorted arrays of modification sites of each type.
+
+    uniprot_ids: sorted uniprot ids of proteins, proteins are referred to by index into it
+    has_mapping: whether each protein has a mapping to its 3D structure
+    keys: for each modification type a sorted array of protein index << POSITION_BITS | position
+    structure_residues: for each type the residue number of each site in the 3D structure, 0 if not in it
+    """
+
+    def __init__(self, uniprot_ids: np.ndarray, has_mapping: np.ndarray,
+                 keys: Dict[str, np.ndarray], structure_residues: Dict[str, np.ndarray]):
+        self.uniprot_ids = uniprot_ids
+        self.has_mapping = has_mapping
+        self.keys = keys
+        self.structure_residues = structure_residues
+        self.protein_indices = {uniprot_id: i for (i, uniprot_id) in enumerate(uniprot_ids.tolist())}
+        # proteins with at least one site of each type
+        self.proteins_of_type = {modification_type: np.unique(type_keys >> POSITION_BITS)
+                                 for (modification_type, type_keys) in keys.items()}
+
+    @classmethod
+    def build(cls, db_connection) -> 'SiteIndex':
+        cursor = db_connection.cursor()
+        cursor.execute("SELECT uniprot_id, mapping FROM mtmod_proteins ORDER BY uniprot_id")
+        uniprot_ids = []
+        mappings = []
+        for (uniprot_id, mapping) in cursor:
+            uniprot_ids.append(uniprot_id)
+            mappings.append(None if mapping is None else np.array(json.loads(mapping), dtype=np.int64))
+        protein_indices = {uniprot_id: i for (i, uniprot_id) in enumerate(uniprot_ids)}
+
+        sites = {}
+        cursor.execute("SELECT uniprot_id, position, modification_type FROM mtmod_modifications")
+        for (uniprot_id, position, modification_type) in cursor:
+            # modifications of proteins missing in mtmod_proteins are skipped
+            if uniprot_id in protein_indices:
+                sites.setdefault(modification_type, []).append((protein_indices[uniprot_id], position))
+
+        keys = {}
+        structure_residues = {}
+        for (modification_type, type_sites) in sorted(sites.items()):
+            array = np.array(type_sites, dtype=np.int64)
+            order = np.lexsort((array[:, 1], array[:, 0]))
+            array = array[order]
+            keys[modification_type] = (array[:, 0] << POSITION_BITS) | array[:, 1]
+            residues = np.zeros(len(array), dtype=np.int64)
+            for (i, (protein, position)) in enumerate(array.tolist()):
+                mapping = mappings[protein]
+                if mapping is not None and 0 < position <= len(mapping):
+                    residues[i] = mapping[position - 1] + 1
+            structure_residues[modification_type] = residues
+        has_mapping = np.array([mapping is not None for mapping in mappings], dtype=bool)
+        return cls(np.array(uniprot_ids, dtype=str), has_mapping, keys, structure_residues)
+
+    def save(self, path: str, stamps: Sequence[int] = ()) -> None:
+        types = list(self.keys)
+        arrays = {'uniprot_ids': self.uniprot_ids, 'has_mapping': self.has_mapping,
+                  'types': np.array(types, dtype=str), 'stamps': np.array(stamps, dtype=np.int64)}
+        for (i, modification_type) in enumerate(types):
+            arrays[f'keys_{i}'] = self.keys[modification_type]
+            arrays[f'structure_residues_{i}'] = self.structure_residues[modification_type]
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, database_path: str = None, index_path: str = None) -> 'SiteIndex':
+        """Load the cached index, or build and cache it if the database changed since"""
+        database_path = config.database_path if database_path is None else database_path
+        index_path = config.site_index_path if index_path is None else index_path
+        stamps = _get_database_stamps(database_path)
+        if os.path.exists(index_path):
+            with np.load(index_path, allow_pickle=False) as arrays:
+                if arrays['stamps'].tolist() == stamps:
+                    types = arrays['types'].tolist()
+                    return cls(arrays['uniprot_ids'], arrays['has_mapping'],
+                               {t: arrays[f'keys_{i}'] for (i, t) in enumerate(types)},
+                               {t: arrays[f'structure_residues_{i}'] for (i, t) in enumerate(types)})
+
+        print(f'Building index of modification sites of {database_path}', file=sys.stderr)
+        db_connection = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+        index = cls.build(db_connection)
+        db_connection.close()
+        index.save(index_path, stamps)
+        return index
+
+    def _check_type(self, modification_type: str) -> None:
+        if modification_type not in self.keys:
+            raise ValueError(f'No sites of modification type {modification_type}, '
+                             f'types in the database: {", ".join(self.keys)}')
+
+    def get_protein_indices(self, uniprot_ids: Sequence[str]) -> np.ndarray:
+        missing = [uniprot_id for uniprot_id in uniprot_ids if uniprot_id not in self.protein_indices]
+        if missing:
+            raise ValueError(f'Proteins not in the database: {", ".join(missing)}')
+        return np.unique(np.array([self.protein_indices[uniprot_id] for uniprot_id in uniprot_ids],
+                                  dtype=np.int64))
+
+    def select(self, modification_type: str, start: int = 1, end: int = POSITION_MASK,
+               proteins: np.ndarray = None, with_mapping: bool = False, in_structure: bool = False) -> np.ndarray:
+        """Indices (into keys[modification_type]) of sites with start <= position <= end.
+
+        proteins: indices of proteins to search, all proteins if None
+        with_mapping: only proteins with a mapping to their 3D structure
+        in_structure: only sites present in the 3D structure
+        """
+        self._check_type(modification_type)
+        type_keys = self.keys[modification_type]
+        candidates = self.proteins_of_type[modification_type]
+        if proteins is not None:
+            candidates = np.intersect1d(candidates, proteins, assume_unique=True)
+        if with_mapping:
+            candidates = candidates[self.has_mapping[candidates]]
+        # one binary search for the beginning and one for the end of the range in each protein
+        starts = np.searchsorted(type_keys, (candidates << POSITION_BITS) | max(start, 0), side='left')
+        ends = np.searchsorted(type_keys, (candidates << POSITION_BITS) | min(end, POSITION_MASK), side='right')
+        # empty ranges if start > end
+        indices = _get_indices_of_ranges(starts, np.maximum(ends, starts))
+        if in_structure:
+            indices = indices[self.structure_residues[modification_type][indices] > 0]
+        return indices
+
+    def select_near(self, modification_type: str, other_types: Sequence[str], within: int,
+                    indices: np.ndarray = None) -> np.ndarray:
+        """Sites of modification_type with a site of each of other_types at most within residues away.
+
+        indices: sites of modification_type to check, all if None
+        """
+        self._check_type(modification_type)
+        type_keys = self.keys[modification_type]
+        if indices is None:
+            indices = np.arange(len(type_keys), dtype=np.int64)
+        for other_type in other_types:
+            self._check_type(other_type)
+            keys = type_keys[indices]
+            positions = keys & POSITION_MASK
+            # the window must not reach into the previous protein
+            low = keys - np.minimum(positions, within)
+            high = keys + within
+            other_keys = self.keys[other_type]
+            found = (np.searchsorted(other_keys, high, side='right')
+                     - np.searchsorted(other_keys, low, side='left')) > 0
+            indices = indices[found]
+        return indices
+
+    def proteins_with_all(self, modification_types: Sequence[str]) -> np.ndarray:
+        """Indices of proteins with sites of all given types"""
+        for modification_type in modification_types:
+            self._check_type(modification_type)
+        proteins = self.proteins_of_type[modification_types[0]]
+        for modification_type in modification_types[1:]:
+            proteins = np.intersect1d(proteins, self.proteins_of_type[modification_type], assume_unique=True)
+        return proteins
+
+    def count_by_protein(self, modification_type: str, indices: np.ndarray) -> np.ndarray:
+        """Number of selected sites of each protein"""
+        proteins = self.keys[modification_type][indices] >> POSITION_BITS
+        return np.bincount(proteins, minlength=len(self.uniprot_ids))
+
+
+def _format_rows(rows: Iterator[list], columns: List[str], output_format: str) -> Iterator[str]:
+    if output_format == 'tsv':
+        yield '\t'.join(columns) + '\n'
+        for row in rows:
+            yield '\t'.join('' if value is None else str(value) for value in row) + '\n'
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row))) + '\n'
+
+
+def _write(lines: Iterator[str], out=None) -> None:
+    """Write lines to out (stdout by default) in chunks of CHUNK_ROWS"""
+    out = sys.stdout if out is None else out
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= CHUNK_ROWS:
+            out.write(''.join(chunk))
+            chunk = []
+    out.write(''.join(chunk))
+    out.flush()
+
+
+def iter_sites(index: SiteIndex, selections: Dict[str, np.ndarray]) -> Iterator[list]:
+    """Rows (uniprot_id, position, modification_type, structure_residue) of selected sites
+    of several types, ordered by protein and position"""
+    types = list(selections)
+    if not types:
+        return
+    keys = np.concatenate([index.keys[t][selections[t]] for t in types])
+    type_numbers = np.concatenate([np.full(len(selections[t]), i, dtype=np.int64) for (i, t) in enumerate(types)])
+    residues = np.concatenate([index.structure_residues[t][selections[t]] for t in types])
+    order = np.lexsort((type_numbers, keys))
+    for chunk_start in range(0, len(order), CHUNK_ROWS):
+        chunk = order[chunk_start:chunk_start + CHUNK_ROWS]
+        chunk_keys = keys[chunk]
+        uniprot_ids = index.uniprot_ids[chunk_keys >> POSITION_BITS].tolist()
+        positions = (chunk_keys & POSITION_MASK).tolist()
+        for (uniprot_id, position, type_number, residue) in zip(uniprot_ids, positions, type_numbers[chunk].tolist(),
+                                                                residues[chunk].tolist()):
+            yield [uniprot_id, position, types[type_number], residue or None]
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--database", default=config.database_path)
+    parser.add_argument("--format", dest="output_format", choices=['tsv', 'jsonl'], default='tsv')
+    parser.add_argument("--time", action="store_true", help="print the time of the query to stderr")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_filters(subparser):
+        subparser.add_argument("-t", "--type", dest="types", action="append", default=[],
+                               help="modification type (Code of modifications.csv), can be repeated")
+        subparser.add_argument("-p", "--protein", dest="proteins", action="append",
+                               help="uniprot id, can be repeated")
+        subparser.add_argument("--start", type=int, default=1, help="first position of the range")
+        subparser.add_argument("--end", type=int, default=POSITION_MASK, help="last position of the range")
+        subparser.add_argument("--with-mapping", dest="with_mapping", action="store_true",
+                               help="only proteins with a mapping to their 3D structure")
+        subparser.add_argument("--in-structure", dest="in_structure", action="store_true",
+                               help="only sites present in the 3D structure")
+
+    sites_parser = subparsers.add_parser("sites", help="list sites")
+    add_filters(sites_parser)
+    sites_parser.add_argument("--within", type=int,
+                              help="only sites of the first type with sites of all other types at most this far")
+    proteins_parser = subparsers.add_parser("proteins", help="list proteins with sites of all given types")
+    add_filters(proteins_parser)
+    count_parser = subparsers.add_parser("count", help="count sites of each type")
+    add_filters(count_parser)
+    count_parser.add_argument("--by-protein", dest="by_protein", action="store_true",
+                              help="count sites of each protein and type")
+    args = parser.parse_args(argv)
+    if args.start > args.end:
+        parser.error(f'--start {args.start} is greater than --end {args.end}')
+
+    index = SiteIndex.load(args.database, config.site_index_path)
+    start_time = time.perf_counter()
+    try:
+        proteins = None if args.proteins is None else index.get_protein_indices(args.proteins)
+        types = args.types or list(index.keys)
+
+        def select(modification_type):
+            return index.select(modification_type, args.start, args.end, proteins,
+                                args.with_mapping, args.in_structure)
+
+        if args.command == "sites":
+            if args.within is not None:
+                selections = {types[0]: index.select_near(types[0], types[1:], args.within, select(types[0]))}
+            else:
+                selections = {modification_type: select(modification_type) for modification_type in types}
+            rows = iter_sites(index, selections)
+            columns = ['uniprot_id', 'position', 'modification_type', 'structure_residue']
+        elif args.command == "proteins":
+            # proteins with selected sites of all types
+            protein_indices = index.proteins_with_all(types)
+            for modification_type in types:
+                protein_indices = np.intersect1d(
+                    protein_indices, index.keys[modification_type][select(modification_type)] >> POSITION_BITS)
+            rows = ([uniprot_id] for uniprot_id in index.uniprot_ids[protein_indices].tolist())
+            columns = ['uniprot_id']
+        elif args.by_protein:
+            counts = {modification_type: index.count_by_protein(modification_type, select(modification_type))
+                      for modification_type in types}
+            rows = ([index.uniprot_ids[protein], modification_type, int(type_counts[protein])]
+                    for (modification_type, type_counts) in counts.items()
+                    for protein in np.flatnonzero(type_counts).tolist())
+            columns = ['uniprot_id', 'modification_type', 'count']
+        else:
+            # selected here, so that errors of unknown types are reported before any output
+            rows = [[modification_type, len(select(modification_type))] for modification_type in types]
+            columns = ['modification_type', 'count']
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        _write(_format_rows(rows, columns, args.output_format))
+    except BrokenPipeError:
+        # output closed early, e.g. by head
+        sys.stderr.close()
+        sys.exit(0)
+    if args.time:
+        print(f'Query took {(time.perf_counter() - start_time) * 1000:.1f} ms', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,167 @@
 import os
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
-from Bio import SeqIO, pairwise2
+from Bio import SeqIO
+from Bio.Align import PairwiseAligner
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from sys import stderr
 import pandas as pd
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Iterable
 import config
+from build_metrics import metrics
 
-def _load_reference_sequence_records() -> Dict[str, SeqRecord]:
-    reference_sequence_records = {}
+def _get_source_stamps() -> List[Tuple[str, int, int]]:
+    """Path, size and modification time of each file the reference index is built from"""
+    paths = [config.sgd_fasta_path, config.uniprot_fasta_path, config.sgd_gene_table_path]
+    return [(os.path.abspath(path), os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in paths]
+
+
+def _load_map_systematic_gene_name_to_uniprot_id() -> Iterable[Tuple[str, str]]:
+    df = pd.read_csv(config.sgd_gene_table_path, sep='\t', skiprows=range(7), header=None, names=['col{}'.format(x) for x in range(17)],
+                     usecols=[10, 16], dtype=str)
+
+    # skip rows where systematic_gene_name or uniprot id is not filled
+    df = df.dropna()
+    gene_names = df.iloc[:, 0].str.partition('|')[0]
+    uniprot_ids = df.iloc[:, 1].str[10:]
+    return zip(gene_names, uniprot_ids)
+
+
+def _build_reference_index(path: str, source_stamps: List[Tuple[str, int, int]]) -> None:
+    """Store sequences from SGD and Uniprot fasta files and the SGD gene table in an SQLite database"""
+    print('Building index of reference sequences', file=stderr)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db_connection = sqlite3.connect(tmp_path)
+    db_connection.executescript("""
+        CREATE TABLE sgd_sequences (systematic_gene_name TEXT PRIMARY KEY, sequence TEXT NOT NULL, description TEXT NOT NULL);
+        CREATE TABLE uniprot_sequences (uniprot_id TEXT PRIMARY KEY, sequence TEXT NOT NULL, description TEXT NOT NULL);
+        CREATE TABLE gene_table (systematic_gene_name TEXT PRIMARY KEY, uniprot_id TEXT NOT NULL);
+        CREATE TABLE sources (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL);
+    """)
+
+    # later records replace earlier ones with the same id, as in a dictionary
     with open(config.sgd_fasta_path) as f:
-        for record in SeqIO.parse(f, "fasta"):
-            reference_sequence_records[record.id] = record
-    return reference_sequence_records
+        db_connection.executemany(
+            "INSERT OR REPLACE INTO sgd_sequences VALUES (?, ?, ?)",
+            ((record.id, str(record.seq), record.description) for record in SeqIO.parse(f, "fasta"))
+        )
 
-def _load_uniprot_sequence_records() -> Dict[str, SeqRecord]:
-    reference_sequence_records = {}
-    with open(config.uniprot_fasta_path) as f:
-        for record in SeqIO.parse(f, "fasta"):
+    def uniprot_rows(records):
+        for record in records:
             parts = record.id.split("|")
             assert len(parts) == 3
-            reference_sequence_records[parts[1]] = record
-    return reference_sequence_records
+            yield parts[1], str(record.seq), record.description
+
+    with open(config.uniprot_fasta_path) as f:
+        db_connection.executemany(
+            "INSERT OR REPLACE INTO uniprot_sequences VALUES (?, ?, ?)", uniprot_rows(SeqIO.parse(f, "fasta"))
+        )
+
+    db_connection.executemany(
+        "INSERT OR REPLACE INTO gene_table VALUES (?, ?)", _load_map_systematic_gene_name_to_uniprot_id()
+    )
+    db_connection.executemany("INSERT INTO sources VALUES (?, ?, ?)", source_stamps)
+    db_connection.commit()
+    db_connection.close()
+    os.replace(tmp_path, path)
+
+
+def _update_reference_index(path: str) -> None:
+    """Build the index of reference sequences if it is missing or its source files changed"""
+    source_stamps = _get_source_stamps()
+    if os.path.exists(path):
+        db_connection = sqlite3.connect(path)
+        try:
+            stored_stamps = db_connection.execute("SELECT path, size, mtime_ns FROM sources ORDER BY path").fetchall()
+        except sqlite3.DatabaseError:
+            stored_stamps = None
+        db_connection.close()
+        if stored_stamps == sorted(source_stamps):
+            return
+
+    _build_reference_index(path, source_stamps)
+
+
+class ReferenceStore:
+    """Reference sequences and SGD gene table, loaded lazily on first access.
+
+    The first access (or an explicit load) checks the index and rebuilds it if needed,
+    guarded by a lock. Each thread and process then reads the index through its own
+    read-only connection, so one store can be shared by parallel workers.
+    """
+
+    def __init__(self, path: str = None):
+        # None means config.reference_index_path at the time of loading
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._generation = 0
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # locks and connections can not be sent to other processes, they are created anew there
+        return {'path': self.path, '_loaded': self._loaded, '_generation': self._generation}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+        self._loaded = state['_loaded']
+        self._generation = state['_generation']
+
+    def _get_path(self) -> str:
+        return config.reference_index_path if self.path is None else self.path
+
+    def load(self) -> None:
+        """Make sure the index is up to date, does nothing if already loaded"""
+        with self._lock:
+            if not self._loaded:
+                _update_reference_index(self._get_path())
+                self._loaded = True
+
+    def refresh(self) -> None:
+        """Check the source files again and rebuild the index if they changed"""
+        with self._lock:
+            _update_reference_index(self._get_path())
+            self._loaded = True
+            self._generation += 1
 
+    def _get_connection(self) -> sqlite3.Connection:
+        if not self._loaded:
+            self.load()
+        key = (os.getpid(), self._generation)
+        if getattr(self._local, 'key', None) != key:
+            self._local.connection = sqlite3.connect(f'file:{self._get_path()}?mode=ro', uri=True)
+            self._local.key = key
+        return self._local.connection
 
-preload_reference_sequence_records = _load_reference_sequence_records()
-preload_uniprot_sequence_records = _load_uniprot_sequence_records()
+    def _get_record(self, table: str, key_column: str, key: str) -> Tuple[str, str]:
+        return self._get_connection().execute(
+            f"SELECT sequence, description FROM {table} WHERE {key_column} = ?", (key,)
+        ).fetchone()
+
+    def get_uniprot_record(self, uniprot_id: str) -> Tuple[str, str]:
+        """Sequence and description from the Uniprot fasta file, or None if not found"""
+        return self._get_record('uniprot_sequences', 'uniprot_id', uniprot_id)
+
+    def get_sgd_record(self, systematic_gene_name: str) -> Tuple[str, str]:
+        """Sequence and description from the SGD fasta file, or None if not found"""
+        return self._get_record('sgd_sequences', 'systematic_gene_name', systematic_gene_name)
+
+    def get_uniprot_id(self, systematic_gene_name: str) -> str:
+        """Uniprot ID of a gene from the SGD gene table, or None if not found"""
+        row = self._get_connection().execute(
+            "SELECT uniprot_id FROM gene_table WHERE systematic_gene_name = ?", (systematic_gene_name,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+
+reference_store = ReferenceStore()
 
 
 def _get_reference_sequence_and_description(
@@ -35,22 +170,22 @@ def _get_reference_sequence_and_description(
     
     seq = None
     description = None
-    if uniprot_id in preload_uniprot_sequence_records:
-        seq_record = preload_uniprot_sequence_records[uniprot_id]
-        seq = str(seq_record.seq)
-        description = seq_record.description
+    uniprot_record = reference_store.get_uniprot_record(uniprot_id)
+    if uniprot_record is not None:
+        seq, description = uniprot_record
         
-    if systematic_gene_name in preload_reference_sequence_records:
-        seq_record = preload_reference_sequence_records[systematic_gene_name]
+    sgd_record = reference_store.get_sgd_record(systematic_gene_name)
+    if sgd_record is not None:
         if seq is None:
-            print(f"Using SGD sequence for protein {uniprot_id}", file=stderr)
-            seq = str(seq_record.seq).rstrip('*')
-        description = seq_record.description
+            metrics.warn('sgd_sequence_used', f"Using SGD sequence for protein {uniprot_id}")
+            seq = sgd_record[0].rstrip('*')
+        description = sgd_record[1]
 
     if seq is None or description is None:
-        print(
+        metrics.warn(
+            'reference_sequence_missing',
             f'Did not find reference sequence for protein {systematic_gene_name}. '
-            f'Protein will not be inserted!', file=stderr
+            f'Protein will not be inserted!'
         )
     return seq, description
 
@@ -58,20 +193,68 @@ def _get_reference_sequence_and_description(
 def _get_pdb_filename(uniprot_id: str) -> str:
     return f'{config.pdb_file_prefix}{uniprot_id}.pdb'
 
-def _download_pdb(uniprot_id: str) -> None:
+def _download_pdb(uniprot_id: str, session: requests.Session, url_template: str, timeout: float) -> str:
+    """Download one pdb file unless it exists, return status: existing, downloaded, missing or failed"""
     pdb_file_path = _get_pdb_filename(uniprot_id)
-    if not os.path.exists(pdb_file_path):
-        url = f'https://alphafold.ebi.ac.uk/files/AF-{uniprot_id}-F1-model_v2.pdb'
-        r = requests.get(url)
-        if not r.status_code == 200:
-            print(
-                f'Failed to get 3D structure of protein {uniprot_id}. Request status code {r.status_code}. '
-                f'Inserting protein anyway.', file=stderr
-            )
-            return
+    if os.path.exists(pdb_file_path):
+        return 'existing'
+
+    url = url_template.format(uniprot_id=uniprot_id)
+    try:
+        r = session.get(url, timeout=timeout)
+    except requests.RequestException as e:
+        metrics.warn(
+            'download_failed',
+            f'Failed to get 3D structure of protein {uniprot_id}: {e}. '
+            f'Inserting protein anyway.'
+        )
+        return 'failed'
+    if not r.status_code == 200:
+        metrics.warn(
+            'structure_not_in_alphafold' if r.status_code == 404 else 'download_failed',
+            f'Failed to get 3D structure of protein {uniprot_id}. Request status code {r.status_code}. '
+            f'Inserting protein anyway.'
+        )
+        return 'missing' if r.status_code == 404 else 'failed'
+
+    # write to a temporary file first so that an interrupted download does not leave a partial pdb file
+    tmp_path = f'{pdb_file_path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(r.content)
+    os.replace(tmp_path, pdb_file_path)
+    return 'downloaded'
+
+
+def download_pdbs(
+        uniprot_ids: Iterable[str], workers: int = 8, retries: int = 3, timeout: float = 60,
+        url_template: str = config.alphafold_pdb_url
+) -> Dict[str, str]:
+    """Download missing AlphaFold pdb files of several proteins in parallel.
+
+    Requests share one pooled session, transient errors are retried with exponential backoff.
+    Returns a dictionary with the status of each protein and prints a summary to stderr.
+    """
+    uniprot_ids = list(dict.fromkeys(uniprot_ids))
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    with requests.Session() as session:
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def download(uniprot_id):
+                with metrics.stage('download', uniprot_id):
+                    return _download_pdb(uniprot_id, session, url_template, timeout)
 
-        with open(pdb_file_path, 'wb') as f:
-            f.write(r.content)
+            statuses = executor.map(download, uniprot_ids)
+            result = dict(zip(uniprot_ids, statuses))
+
+    counts = Counter(result.values())
+    print(
+        f'Structures of {len(result)} proteins: {counts["existing"]} already downloaded, '
+        f'{counts["downloaded"]} downloaded, {counts["missing"]} not in AlphaFold database, '
+        f'{counts["failed"]} failed', file=stderr
+    )
+    return result
 
 
 def _get_pdb_sequence(uniprot_id: str) -> Seq:
@@ -81,80 +264,70 @@ def _get_pdb_sequence(uniprot_id: str) -> Seq:
 
     records = list(SeqIO.parse(pdb_file_path, 'pdb-seqres'))
     if len(records) != 1:
-        print(f'More than one record for protein {uniprot_id}. Ids of records:', file=stderr)
-        for record in records:
-            print(f'  {record.id}', file=stderr)
+        ids = f' with ids {", ".join(record.id for record in records)}' if records else ''
+        metrics.warn('pdb_multiple_records',
+                     f'Expected one SEQRES record in the structure of protein {uniprot_id}, '
+                     f'found {len(records)}{ids}. Protein will have no mapping to the structure.')
         return
 
     record = records[0]
     return record.seq
 
 
-def _get_mapping(reference_sequence: Seq, pdb_sequence: Seq) -> List[int]:
-    #print("\nPAIR", str(reference_sequence), str(pdb_sequence))
-    alignments = pairwise2.align.globalxx(reference_sequence, pdb_sequence)
-    alignment = alignments[0]
-
-    mapping = []
-    i = 0
-    for reference_element, pdb_element in zip(alignment[0], alignment[1]):
-        if reference_element == '-':
-            if pdb_element != '-':
-                i += 1
-        else:
-            if pdb_element == '-':
-                mapping.append(-1)
-            else:
-                mapping.append(i)
-                i += 1
-    return mapping
+_aligner = PairwiseAligner(mode='global', match_score=1, mismatch_score=0, gap_score=0)
 
 
-def get_protein_info(systematic_gene_name: str, uniprot_id: str) -> Tuple[str, List[int], str]:
-    reference_sequence, description = _get_reference_sequence_and_description(systematic_gene_name, uniprot_id)
-    _download_pdb(uniprot_id)
-    pdb_sequence = _get_pdb_sequence(uniprot_id)
+def _get_mapping(reference_sequence: Seq, pdb_sequence: Seq) -> List[int]:
+    """For each position of reference sequence return the aligned position in pdb sequence or -1"""
+    reference_sequence = str(reference_sequence)
+    pdb_sequence = str(pdb_sequence)
 
-    mapping = None
-    if reference_sequence is not None and pdb_sequence is not None:
-        mapping = _get_mapping(reference_sequence, pdb_sequence)
+    # AlphaFold models almost always have exactly the reference sequence
+    if reference_sequence == pdb_sequence:
+        return list(range(len(reference_sequence)))
 
-    reference_sequence = None if reference_sequence is None else str(reference_sequence)
-    return reference_sequence, mapping, description
+    # the same scoring as pairwise2.align.globalxx, but only one optimal alignment is computed
+    alignment = _aligner.align(reference_sequence, pdb_sequence)[0]
 
+    mapping = [-1] * len(reference_sequence)
+    for (reference_start, reference_end), (pdb_start, pdb_end) in zip(*alignment.aligned):
+        mapping[reference_start:reference_end] = range(pdb_start, pdb_end)
+    return mapping
 
-def _load_map_systematic_gene_name_to_uniprot_id() -> dict:
-    df = pd.read_csv(config.sgd_gene_table_path, sep='\t', skiprows=range(7), header=None, names=['col{}'.format(x) for x in range(17)],
-                     usecols=[10, 16])
 
-    map_sys_gene_name_to_uniprot_id = {}
-    for i in range(len(df)):
-        try:
-            gene_name = df.iloc[i, 0].partition('|')[0]
-            uniprot_id = df.iloc[i, 1][10:]
-            map_sys_gene_name_to_uniprot_id[gene_name] = uniprot_id
-        except TypeError:
-            # happens if systematic_gene_name is 'nan' (not filled) and is interpreted as float (float can't be sliced)
-            pass
+def get_protein_info(systematic_gene_name: str, uniprot_id: str) -> Tuple[str, List[int], str]:
+    """Return reference sequence, its mapping to the structure and description of a protein.
 
-    return map_sys_gene_name_to_uniprot_id
+    The structure needs to be downloaded beforehand by download_pdbs, otherwise mapping is None.
+    """
+    with metrics.stage('reference_lookup', uniprot_id):
+        reference_sequence, description = _get_reference_sequence_and_description(systematic_gene_name, uniprot_id)
+    with metrics.stage('alignment', uniprot_id):
+        pdb_sequence = _get_pdb_sequence(uniprot_id)
 
+        mapping = None
+        if reference_sequence is not None and pdb_sequence is not None:
+            mapping = _get_mapping(reference_sequence, pdb_sequence)
 
-preloaded_map_systematic__name_to_uniprot_id = _load_map_systematic_gene_name_to_uniprot_id()
+    reference_sequence = None if reference_sequence is None else str(reference_sequence)
+    return reference_sequence, mapping, description
 
 
 def has_valid_systematic_gene_name_and_uniprot_id(sys_gene_name: str, uniprot_id: str) -> bool:
-    if sys_gene_name not in preloaded_map_systematic__name_to_uniprot_id:
-        print(
+    expected_uniprot_id = reference_store.get_uniprot_id(sys_gene_name)
+    if expected_uniprot_id is None:
+        metrics.warn(
+            'gene_not_in_reference_table',
             f'{sys_gene_name} is not in reference table. Can not check pair {sys_gene_name}, {uniprot_id}. '
-            f'Inserting protein anyway.', file=stderr
+            f'Inserting protein anyway.'
         )
         return True
-    if preloaded_map_systematic__name_to_uniprot_id[sys_gene_name] != uniprot_id:
-        print(
+    if expected_uniprot_id != uniprot_id:
+        metrics.warn(
+            'gene_uniprot_mismatch',
             f'Our pair ({sys_gene_name},{uniprot_id}) does not match the expected pair:'
-            f'({sys_gene_name},{preloaded_map_systematic__name_to_uniprot_id[sys_gene_name]}). '
-            f'Protein will not be inserted!', file=stderr
+            f'({sys_gene_name},{expected_uniprot_id}). '
+            f'Protein will not be inserted!'
         )
         return False
     return True
@@ -0,0 +1,50 @@
+"""Search index of proteins for the search box on index.html.
+
+The index is a JSON file loaded by web_include/search.js. It contains a label
+of each protein shown in search results and a sorted list of words occurring in
+UniProt IDs, gene names, protein names and descriptions, each with the list
+of proteins containing it. The browser finds words starting with a searched
+prefix by binary search in the sorted list, so the search does not need
+to go through all proteins."""
+
+import json
+import re
+
+# fields of protein_info searched by the index
+SEARCHED_FIELDS = ["uniprot_id", "systematic_gene_name", "standard_gene_name",
+                   "protein_name", "gene_names", "description"]
+
+
+def get_words(text):
+        """Lowercase words of a text, split at characters other than letters and digits.
+        search.js splits the searched text in the same way."""
+        if text is None:
+                return []
+        return re.findall(r"[^\W_]+", str(text).lower())
+
+
+def build_search_index(protein_list):
+        """Return the search index of proteins (dictionaries from db_access.get_protein_info)
+
+        proteins: [uniprot_id, label] for each protein
+        words: sorted list of words
+        postings: for each word a sorted list of indices of proteins containing it
+        """
+        proteins = []
+        postings = {}
+        for (i, protein) in enumerate(protein_list):
+                label = " -- ".join(str(protein[key]) for key in
+                                    ["uniprot_id", "systematic_gene_name", "protein_name", "gene_names"])
+                proteins.append([protein["uniprot_id"], label])
+                for key in SEARCHED_FIELDS:
+                        for word in get_words(protein[key]):
+                                word_postings = postings.setdefault(word, [])
+                                if not word_postings or word_postings[-1] != i:
+                                        word_postings.append(i)
+
+        words = sorted(postings)
+        return {"proteins": proteins, "words": words, "postings": [postings[word] for word in words]}
+
+
+def get_search_index_json(protein_list):
+        return json.dumps(build_search_index(protein_list), separators=(',', ':'))
@@ -0,0 +1,104 @@
+"""Persistent cache of structures rendered for GLmol.
+
+The PDB string and GLmol representation of a structure depend only on its pdb file,
+the colored residues and the code exporting the structure. They are stored compressed
+in an SQLite database keyed by a hash of these inputs, so that unchanged structures
+do not need to be rendered by PyMOL again. When the cache grows over the size limit,
+the least recently used structures are removed."""
+
+import sqlite3
+import time
+import zlib
+from typing import Iterable, Iterator, List, Tuple
+
+import config
+from build_manifest import get_file_digest, get_files_digest, get_data_digest
+
+
+class StructureCache:
+
+        def __init__(self, path: str = config.structure_cache_path,
+                     max_bytes: int = config.structure_cache_max_bytes):
+                self.max_bytes = max_bytes
+                self._code_digest = get_files_digest(["pdb_to_html/pymol2glmol.py", "structure_renderer.py"])
+                self._cnx = sqlite3.connect(path)
+                self._cnx.execute(
+                        "CREATE TABLE IF NOT EXISTS structures ("
+                        "key TEXT PRIMARY KEY, pdb_file BLOB NOT NULL, representation BLOB NOT NULL, "
+                        "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+                )
+                self.hits = 0
+                self.misses = 0
+
+        def get_key(self, uniprot_id: str, colored_residues: List[Tuple[int, str]]) -> str:
+                pdb_digest = get_file_digest(f"{config.pdb_file_prefix}{uniprot_id}.pdb")
+                return get_data_digest([self._code_digest, pdb_digest, uniprot_id, colored_residues])
+
+        def get(self, key: str) -> Tuple[str, str]:
+                """Return cached PDB string and representation or None if not cached"""
+                row = self._cnx.execute(
+                        "SELECT pdb_file, representation FROM structures WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                        return None
+                self._cnx.execute("UPDATE structures SET last_used = ? WHERE key = ?", (time.time(), key))
+                return zlib.decompress(row[0]).decode(), zlib.decompress(row[1]).decode()
+
+        def put(self, key: str, pdb_file: str, representation: str) -> None:
+                pdb_blob = zlib.compress(pdb_file.encode())
+                representation_blob = zlib.compress(representation.encode())
+                self._cnx.execute(
+                        "INSERT OR REPLACE INTO structures (key, pdb_file, representation, size, last_used) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (key, pdb_blob, representation_blob, len(pdb_blob) + len(representation_blob), time.time())
+                )
+
+        def imap(self, renderer, jobs: Iterable[Tuple[str, List[Tuple[int, str]]]]) -> Iterator[Tuple[str, str]]:
+                """Yield results of (uniprot_id, colored_residues) jobs in job order.
+
+                Cached structures are read from the cache, the others are rendered by renderer
+                (a StructureRenderer) in parallel and stored in the cache.
+                """
+                jobs = list(jobs)
+                keys = [self.get_key(*job) for job in jobs]
+                cached_keys = set()
+                for key in keys:
+                        if self._cnx.execute("SELECT 1 FROM structures WHERE key = ?", (key,)).fetchone():
+                                cached_keys.add(key)
+                rendered = renderer.imap([job for job, key in zip(jobs, keys) if key not in cached_keys])
+                for key in keys:
+                        if key in cached_keys:
+                                self.hits += 1
+                                yield self.get(key)
+                        else:
+                                self.misses += 1
+                                result = next(rendered)
+                                self.put(key, *result)
+                                self._cnx.commit()
+                                yield result
+
+        def evict(self) -> None:
+                """Remove least recently used structures until the cache fits into max_bytes"""
+                total = self._cnx.execute("SELECT COALESCE(SUM(size), 0) FROM structures").fetchone()[0]
+                if total <= self.max_bytes:
+                        return
+                cursor = self._cnx.execute("SELECT key, size FROM structures ORDER BY last_used")
+                evicted = []
+                for key, size in cursor:
+                        if total <= self.max_bytes:
+                                break
+                        evicted.append((key,))
+                        total -= size
+                self._cnx.executemany("DELETE FROM structures WHERE key = ?", evicted)
+                self._cnx.commit()
+
+        def close(self) -> None:
+                self._cnx.commit()
+                self.evict()
+                self._cnx.close()
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, *args) -> None:
+                self.close()
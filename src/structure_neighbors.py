@@ -0,0 +1,192 @@
+"""Spatial neighborhoods of modification sites in AlphaFold structures.
+
+Each residue of a structure is represented by the centroid of its side-chain atoms, or by its
+CA atom for glycine and for structures with CA atoms only. Coordinates are parsed from the ATOM
+records of the pdb file with vectorized NumPy operations on the fixed columns of the records.
+
+Pairs of residues within a radius are found with a uniform grid of cells with the size of
+the radius: residues are sorted by their cell and each residue is compared only with residues
+in the 27 cells around it, so the work grows with the number of close pairs instead of
+quadratically with the length of the protein.
+
+Neighborhoods are computed before the pages are prepared and stored in config.neighborhood_cache_path,
+so that they are computed again only for proteins whose structure or modification sites changed."""
+
+import json
+import sqlite3
+
+import numpy as np
+
+import config
+from build_manifest import get_file_digest, get_files_digest, get_data_digest
+
+# distance in angstroms between residues considered close
+NEIGHBOR_RADIUS = 8.0
+BACKBONE_ATOMS = [b"N", b"CA", b"C", b"O", b"OXT"]
+
+# offsets of the 27 cells around a cell of the grid, including the cell itself
+_CELL_OFFSETS = np.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64)
+
+
+def get_residue_coordinates(pdb_text):
+        """Return residue numbers (ascending) and coordinates of residues of a pdb file as (n, 3) array"""
+        data = np.frombuffer(pdb_text.encode() if isinstance(pdb_text, str) else pdb_text, dtype=np.uint8)
+        starts = np.concatenate([[0], np.flatnonzero(data == ord("\n")) + 1])
+        # ATOM records end with coordinates in columns 31-54
+        starts = starts[starts + 54 <= len(data)]
+        records = data[starts[:, None] + np.arange(6)]
+        starts = starts[(records == np.frombuffer(b"ATOM  ", dtype=np.uint8)).all(axis=1)]
+        if len(starts) == 0:
+                return np.zeros(0, dtype=np.int64), np.zeros((0, 3))
+        fields = data[starts[:, None] + np.arange(54)]
+
+        atom_names = np.char.strip(fields[:, 12:16].copy().view("S4").ravel())
+        atom_residues = fields[:, 22:26].copy().view("S4").ravel().astype(np.int64)
+        atom_coordinates = fields[:, 30:54].copy().view("S8").astype(np.float64)
+
+        residue_numbers, atom_indices = np.unique(atom_residues, return_inverse=True)
+        side_chain = ~np.isin(atom_names, BACKBONE_ATOMS)
+        counts = np.bincount(atom_indices[side_chain], minlength=len(residue_numbers))
+        coordinates = np.stack([np.bincount(atom_indices[side_chain], atom_coordinates[side_chain, axis],
+                                            minlength=len(residue_numbers)) for axis in range(3)],
+                               axis=1).astype(np.float64)
+        coordinates[counts > 0] /= counts[counts > 0, None]
+
+        # residues without side-chain atoms are represented by CA, or by their first atom if CA is missing
+        without_side_chain = counts == 0
+        if without_side_chain.any():
+                atoms = np.flatnonzero(atom_names == b"CA")
+                first_atoms = np.full(len(residue_numbers), -1)
+                first_atoms[atom_indices[::-1]] = np.arange(len(atom_indices))[::-1]
+                first_atoms[atom_indices[atoms]] = atoms
+                coordinates[without_side_chain] = atom_coordinates[first_atoms[without_side_chain]]
+        return residue_numbers, coordinates
+
+
+class SpatialGrid:
+        """Points sorted by their cells in a grid with cells of the size of radius"""
+
+        def __init__(self, points, radius=NEIGHBOR_RADIUS):
+                self.points = points
+                self.radius = radius
+                cells = np.floor(points / radius).astype(np.int64)
+                # one empty layer of cells on each side, cells of queries are clipped into the grid
+                self._low = cells.min(axis=0, initial=0) - 1
+                self._high = cells.max(axis=0, initial=0) + 1
+                keys = self._get_keys(cells)
+                self._order = np.argsort(keys, kind="stable")
+                self._keys = keys[self._order]
+
+        def _get_keys(self, cells):
+                cells = np.clip(cells, self._low, self._high) - self._low
+                shape = self._high - self._low + 1
+                return (cells[:, 0] * shape[1] + cells[:, 1]) * shape[2] + cells[:, 2]
+
+        def query(self, query_points):
+                """Return query point indices, point indices and distances of all pairs within radius"""
+                cells = np.floor(query_points / self.radius).astype(np.int64)
+                keys = self._get_keys((cells[:, None, :] + _CELL_OFFSETS[None, :, :]).reshape(-1, 3))
+                starts = np.searchsorted(self._keys, keys, side="left")
+                lengths = np.searchsorted(self._keys, keys, side="right") - starts
+                # positions of points in all ranges of sorted points of the cells
+                positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+                query_indices = np.repeat(np.arange(len(keys)) // len(_CELL_OFFSETS), lengths)
+                point_indices = self._order[positions]
+                distances = np.linalg.norm(query_points[query_indices] - self.points[point_indices], axis=1)
+                close = distances <= self.radius
+                return query_indices[close], point_indices[close], distances[close]
+
+
+def get_site_neighborhoods(pdb_text, site_residues, radius=NEIGHBOR_RADIUS):
+        """Residues and other sites close to modification sites in a structure.
+
+        site_residues: residue numbers of the sites in the structure
+        Returns for each site the residue numbers of residues within radius, other than the site,
+        and the list of (index of another site, distance) of sites within radius, ordered by distance.
+        Sites with residues missing in the structure have no neighbors.
+        """
+        residue_numbers, coordinates = get_residue_coordinates(pdb_text)
+        site_residues = np.asarray(site_residues, dtype=np.int64)
+        indices = np.clip(np.searchsorted(residue_numbers, site_residues), 0, max(len(residue_numbers) - 1, 0))
+        present = np.flatnonzero(residue_numbers[indices] == site_residues) if len(residue_numbers) \
+                else np.zeros(0, dtype=np.int64)
+
+        residues = [[] for _ in site_residues]
+        close_sites = [[] for _ in site_residues]
+        if len(present) == 0:
+                return residues, close_sites
+
+        # site to residue neighborhoods
+        grid = SpatialGrid(coordinates, radius)
+        queries, neighbors, _ = grid.query(coordinates[indices[present]])
+        other = residue_numbers[neighbors] != site_residues[present[queries]]
+        for query, residue_number in zip(present[queries[other]].tolist(), residue_numbers[neighbors[other]].tolist()):
+                residues[query].append(residue_number)
+
+        # site to site neighborhoods, on a grid of the sites only
+        site_coordinates = coordinates[indices[present]]
+        queries, neighbors, distances = SpatialGrid(site_coordinates, radius).query(site_coordinates)
+        other = site_residues[present[queries]] != site_residues[present[neighbors]]
+        order = np.lexsort((distances[other], queries[other]))
+        for query, neighbor, distance in zip(present[queries[other][order]].tolist(),
+                                             present[neighbors[other][order]].tolist(),
+                                             distances[other][order].tolist()):
+                close_sites[query].append((neighbor, distance))
+        return [sorted(site) for site in residues], close_sites
+
+
+class NeighborhoodStore:
+        """Neighborhoods of modification sites of each protein, stored in an SQLite database.
+
+        Neighborhoods of a protein are stored with a hash of its pdb file, the residue numbers
+        of its sites and this module, one row for each protein.
+        """
+
+        def __init__(self, path: str = config.neighborhood_cache_path):
+                self._code_digest = get_files_digest(["structure_neighbors.py"])
+                self._cnx = sqlite3.connect(path)
+                self._cnx.execute(
+                        "CREATE TABLE IF NOT EXISTS neighborhoods ("
+                        "uniprot_id TEXT PRIMARY KEY, key TEXT NOT NULL, neighborhoods TEXT NOT NULL)"
+                )
+                self.computed = 0
+
+        def get(self, uniprot_id, site_residues):
+                """Return neighborhoods of sites at residue numbers site_residues of the structure of a protein.
+
+                The result maps the residue number of each site to the list of residue numbers
+                of residues within NEIGHBOR_RADIUS and the list of (residue number, distance) of other
+                sites within NEIGHBOR_RADIUS, ordered by distance. Neighborhoods are computed and
+                stored unless they are already stored for the same inputs.
+                """
+                site_residues = sorted(site_residues)
+                pdb_path = f"{config.pdb_file_prefix}/{uniprot_id}.pdb"
+                key = get_data_digest([self._code_digest, get_file_digest(pdb_path), site_residues])
+                row = self._cnx.execute(
+                        "SELECT key, neighborhoods FROM neighborhoods WHERE uniprot_id = ?", (uniprot_id,)
+                ).fetchone()
+                if row is not None and row[0] == key:
+                        stored = json.loads(row[1])
+                else:
+                        with open(pdb_path, "rb") as f:
+                                residues, close_sites = get_site_neighborhoods(f.read(), site_residues)
+                        stored = [[site_residues[i], residues[i],
+                                   [[site_residues[j], round(distance, 3)] for j, distance in close_sites[i]]]
+                                  for i in range(len(site_residues))]
+                        self._cnx.execute(
+                                "INSERT OR REPLACE INTO neighborhoods (uniprot_id, key, neighborhoods) VALUES (?, ?, ?)",
+                                (uniprot_id, key, json.dumps(stored, separators=(',', ':')))
+                        )
+                        self.computed += 1
+                return {site: (residues, [tuple(close) for close in close_sites])
+                        for site, residues, close_sites in stored}
+
+        def close(self) -> None:
+                self._cnx.commit()
+                self._cnx.close()
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, *args) -> None:
+                self.close()
@@ -0,0 +1,100 @@
+"""Rendering of 3D structures for GLmol by PyMOL instances kept alive in worker processes.
+
+Each worker process starts one PyMOL instance through the pymol2 API and reuses it
+for all structures it renders. The results are returned in memory, no files are written.
+This replaces running pymol_script.pml in a new pymol process for each protein."""
+
+import multiprocessing
+import time
+from typing import Iterable, Iterator, List, Tuple
+
+import config
+from build_metrics import metrics
+
+# PyMOL instance of the current worker process
+_pymol = None
+
+
+def _start_pymol() -> None:
+        global _pymol
+        import pymol2
+        _pymol = pymol2.PyMOL()
+        _pymol.start()
+
+
+def _render_structure(job: Tuple[str, List[Tuple[int, str]]]) -> Tuple[str, str]:
+        """Color residues of one structure, return its PDB string and GLmol representation.
+
+        job: uniprot_id and a list of (residue number, #rrggbb color) pairs
+        """
+        from pdb_to_html.pymol2glmol import get_rep
+
+        uniprot_id, colored_residues = job
+        cmd = _pymol.cmd
+        cmd.reinitialize()
+        cmd.load(f"{config.pdb_file_prefix}{uniprot_id}.pdb", uniprot_id)
+        cmd.color("gray")
+        cmd.show(representation="ribbon")
+
+        # set of colors seen so far
+        colors = set()
+        for pos, color in colored_residues:
+                color = color.lstrip('#')
+                if color not in colors:
+                        cmd.set_color(color, [int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)])
+                        colors.add(color)
+                cmd.color(color, f"resi {pos}")
+        return get_rep(uniprot_id, _self=cmd, compact=True)
+
+
+def _render_structure_timed(job: Tuple[str, List[Tuple[int, str]]]) -> Tuple[Tuple[str, str], float]:
+        """Result of _render_structure and the time it took in the worker"""
+        start = time.perf_counter()
+        result = _render_structure(job)
+        return result, time.perf_counter() - start
+
+
+class StructureRenderer:
+        """Pool of worker processes, each with its own running PyMOL instance.
+
+        The workers are started only when the first structure is rendered.
+        """
+
+        def __init__(self, processes: int = 1):
+                self.processes = processes
+                self._pool = None
+
+        def _get_pool(self):
+                if self._pool is None:
+                        self._pool = multiprocessing.Pool(self.processes, initializer=_start_pymol)
+                return self._pool
+
+        def render(self, uniprot_id: str, colored_residues: List[Tuple[int, str]]) -> Tuple[str, str]:
+                """Return PDB string and GLmol representation of a structure with colored residues."""
+                result, seconds = self._get_pool().apply(_render_structure_timed, ((uniprot_id, colored_residues),))
+                metrics.add_time('pymol', seconds, uniprot_id)
+                return result
+
+        def imap(self, jobs: Iterable[Tuple[str, List[Tuple[int, str]]]]) -> Iterator[Tuple[str, str]]:
+                """Render (uniprot_id, colored_residues) jobs in parallel, yield results in job order."""
+                jobs = list(jobs)
+                if not jobs:
+                        return iter(())
+                return self._imap(jobs)
+
+        def _imap(self, jobs):
+                # PyMOL time of each structure is measured in the worker and recorded here
+                for job, (result, seconds) in zip(jobs, self._get_pool().imap(_render_structure_timed, jobs)):
+                        metrics.add_time('pymol', seconds, job[0])
+                        yield result
+
+        def close(self) -> None:
+                if self._pool is not None:
+                        self._pool.close()
+                        self._pool.join()
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, *args) -> None:
+                self.close()
@@ -0,0 +1,219 @@
+"""Generator of synthetic input data of excel_parser.py and html_builder.py for benchmarks.
+
+It writes a proteome with random sequences in the formats of the real inputs: SGD and UniProt
+fasta files, the SGD gene association table, AlphaFold-like pdb files of all proteins
+and an Excel workbook with the proteome, sources and modification sheets, together with
+modifications.csv. The scale (number of proteins) and the density of modification sites are
+configurable, the same seed always gives the same data.
+
+Some records deliberately exercise the slower paths of the pipeline: a fraction of structures
+differs from the reference sequence and needs an alignment, some proteins are missing
+in the UniProt fasta file, some sites are listed twice and some reference cells are invalid.
+
+Usage: python3 synthetic_proteome.py directory [--proteins N] [--site-density D] [--seed S]"""
+
+import argparse
+import json
+import math
+import os
+from sys import stderr
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from Bio.SeqUtils import seq3
+
+import config
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+SOURCES = ['Src{:02d}'.format(i) for i in range(1, 11)]
+# rows of one sheet of an xlsx file, without the header
+EXCEL_MAX_ROWS = 1048575
+
+PROTEOME_COLUMNS = ['Systematic gene name', 'Standard gene name', 'Uniprot_ID', 'Protein names', 'Gene names',
+                    'Length']
+SOURCES_COLUMNS = ['Short reference:', 'Full reference', 'DOI', 'Annotation']
+MODIFICATION_COLUMNS = ['Systematic gene name', 'Standard gene name', 'Uniprot_ID', 'Modified site', 'Annotation'] \
+    + SOURCES + ['Other']
+
+# files of a generated data set, relative to its directory
+PATHS = {
+    'excel_path': 'workbook.xlsx',
+    'modifications_csv_path': 'modifications.csv',
+    'sgd_fasta_path': 'sgd.fasta',
+    'uniprot_fasta_path': 'uniprot.fasta',
+    'sgd_gene_table_path': 'gene_association.gaf',
+    'pdb_file_prefix': 'pdb/',
+}
+PARAMETERS_FILE = 'parameters.json'
+
+_THREE_LETTER_CODES = {amino_acid: seq3(amino_acid).upper() for amino_acid in AMINO_ACIDS}
+
+
+def _get_sequences(rng, proteins: int):
+    # lengths roughly follow the distribution of yeast proteins, with a long tail
+    lengths = np.clip(rng.lognormal(np.log(400), 0.6, proteins).astype(int), 50, 5000)
+    residues = np.frombuffer(AMINO_ACIDS.encode(), dtype='S1')[rng.integers(0, len(AMINO_ACIDS), lengths.sum())]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    residues[offsets[:-1]] = b'M'
+    return residues, offsets
+
+
+def _write_fasta(path: str, records) -> None:
+    with open(path, 'w') as f:
+        for (header, sequence) in records:
+            f.write(f'>{header}\n')
+            for i in range(0, len(sequence), 80):
+                f.write(sequence[i:i + 80] + '\n')
+
+
+def get_pdb_text(uniprot_id: str, sequence: str, backbone: bool = False) -> str:
+    """AlphaFold-like pdb file of a sequence: SEQRES records and a helix of residues
+    with pLDDT in the B-factor column, with CA atoms only unless backbone is True"""
+    names = [_THREE_LETTER_CODES[amino_acid] for amino_acid in sequence]
+    lines = [f'HEADER    SYNTHETIC PROTEIN                       01-JAN-22                  ',
+             f'TITLE     SYNTHETIC ALPHAFOLD-LIKE MODEL FOR {uniprot_id}']
+    for i in range(0, len(names), 13):
+        lines.append(f'SEQRES {i // 13 + 1:3d} A {len(names):4d}  ' + ' '.join(names[i:i + 13]))
+    atoms = [('N', -0.5, 'N'), ('CA', 0.0, 'C'), ('C', 0.5, 'C'), ('O', 0.8, 'O')] if backbone else [('CA', 0.0, 'C')]
+    serial = 1
+    for (i, name) in enumerate(names):
+        plddt = 50 + 45 * abs(math.sin(i / 17))
+        for (atom, shift, element) in atoms:
+            angle = (i + shift) * 1.745
+            lines.append(f'ATOM  {serial:5d}  {atom:<3s} {name} A{i + 1:4d}    '
+                         f'{2.3 * math.cos(angle):8.3f}{2.3 * math.sin(angle):8.3f}{1.5 * (i + shift):8.3f}'
+                         f'  1.00{plddt:6.2f}           {element}')
+            serial += 1
+    lines.append(f'TER   {serial:5d}      {names[-1]} A{len(names):4d}')
+    lines.append('END')
+    return '\n'.join(lines) + '\n'
+
+
+def _get_modification_sheet(rng, residues, offsets, uniprot_ids, gene_names, allowed_amino_acids: str,
+                            site_density: float) -> pd.DataFrame:
+    if allowed_amino_acids == '*':
+        allowed = np.ones(len(residues), dtype=bool)
+    else:
+        allowed = np.isin(residues, np.frombuffer(allowed_amino_acids.encode(), dtype='S1'))
+    indices = np.flatnonzero(allowed & (rng.random(len(residues)) < site_density))
+    # about one site in 200 is listed twice
+    indices = np.sort(np.concatenate([indices, rng.choice(indices, len(indices) // 200)]))
+    proteins = np.searchsorted(offsets, indices, side='right') - 1
+    if len(indices) > EXCEL_MAX_ROWS:
+        raise ValueError(f'{len(indices)} sites do not fit into one Excel sheet, use a lower site density')
+
+    sheet = pd.DataFrame({
+        'Systematic gene name': gene_names[proteins],
+        'Standard gene name': np.char.add('G', uniprot_ids[proteins]),
+        'Uniprot_ID': uniprot_ids[proteins],
+        'Modified site': indices - offsets[proteins] + 1,
+        'Annotation': 'synthetic',
+    })
+    for source in SOURCES:
+        sheet[source] = rng.choice(np.array(['YES', None, 'bad'], dtype=object), len(indices), p=[0.3, 0.69, 0.01])
+    sheet['Other'] = rng.choice(np.array([None, SOURCES[0], 'Unknown'], dtype=object), len(indices),
+                                p=[0.9, 0.09, 0.01])
+    return sheet[MODIFICATION_COLUMNS]
+
+
+def _write_workbook(path: str, sheets) -> None:
+    # a write-only workbook is streamed to the file, much faster than DataFrame.to_excel
+    workbook = openpyxl.Workbook(write_only=True)
+    for (sheet_name, sheet) in sheets.items():
+        worksheet = workbook.create_sheet(sheet_name)
+        worksheet.append(list(sheet.columns))
+        for row in sheet.astype(object).where(sheet.notna(), None).itertuples(index=False):
+            worksheet.append(list(row))
+    workbook.save(path)
+
+
+def generate(directory: str, proteins: int = 1000, site_density: float = 0.01, seed: int = 0,
+             structure_mismatch: float = 0.05, missing_uniprot: float = 0.01, backbone: bool = False,
+             modifications_csv_path: str = config.modifications_csv_path) -> dict:
+    """Write a synthetic data set to directory, return its parameters.
+
+    site_density: probability that an allowed residue has a site of each modification type
+    structure_mismatch: fraction of structures with a deletion, which must be aligned
+    missing_uniprot: fraction of proteins only in the SGD fasta file
+    backbone: write N, CA, C and O atoms instead of CA only (about 4 times larger pdb files)
+    """
+    parameters = {'proteins': proteins, 'site_density': site_density, 'seed': seed,
+                  'structure_mismatch': structure_mismatch, 'missing_uniprot': missing_uniprot,
+                  'backbone': backbone}
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(directory, PATHS['pdb_file_prefix']), exist_ok=True)
+
+    residues, offsets = _get_sequences(rng, proteins)
+    sequences = [residues[offsets[i]:offsets[i + 1]].tobytes().decode() for i in range(proteins)]
+    uniprot_ids = np.array([f'X{i:06d}' for i in range(proteins)])
+    gene_names = np.array([f'Y{i:06d}W' for i in range(proteins)])
+
+    print(f'Writing {proteins} proteins to {directory}', file=stderr)
+    _write_fasta(os.path.join(directory, PATHS['sgd_fasta_path']),
+                 ((f'{gene_names[i]} G{uniprot_ids[i]} SGDID:S{i:09d} "Synthetic protein {gene_names[i]}"',
+                   sequences[i] + '*') for i in range(proteins)))
+    in_uniprot = rng.random(proteins) >= missing_uniprot
+    _write_fasta(os.path.join(directory, PATHS['uniprot_fasta_path']),
+                 ((f'sp|{uniprot_ids[i]}|{gene_names[i]}_YEAST Synthetic protein {gene_names[i]} OS=Synthetic',
+                   sequences[i]) for i in range(proteins) if in_uniprot[i]))
+    with open(os.path.join(directory, PATHS['sgd_gene_table_path']), 'w') as f:
+        f.write('!gaf-version: 2.2\n' + '!synthetic\n' * 6)
+        for i in range(proteins):
+            columns = ['SGD', f'S{i:09d}', f'G{uniprot_ids[i]}', '', 'GO:0005739', 'PMID:1', 'IDA', '', 'C',
+                       '', f'{gene_names[i]}|G{uniprot_ids[i]}', 'protein', 'taxon:559292', '20220101', 'SGD', '',
+                       f'UniProtKB:{uniprot_ids[i]}']
+            f.write('\t'.join(columns) + '\n')
+
+    print('Writing pdb files', file=stderr)
+    mismatched = rng.random(proteins) < structure_mismatch
+    for i in range(proteins):
+        sequence = sequences[i]
+        if mismatched[i]:
+            start = int(rng.integers(1, len(sequence) - 20))
+            sequence = sequence[:start] + sequence[start + int(rng.integers(1, 20)):]
+        with open(f"{os.path.join(directory, PATHS['pdb_file_prefix'])}{uniprot_ids[i]}.pdb", 'w') as f:
+            f.write(get_pdb_text(uniprot_ids[i], sequence, backbone))
+
+    modifications_df = pd.read_csv(modifications_csv_path)
+    modifications_df.to_csv(os.path.join(directory, PATHS['modifications_csv_path']), index=False)
+    sheets = {
+        '24_Reference mt proteome': pd.DataFrame({
+            'Systematic gene name': gene_names, 'Standard gene name': np.char.add('G', uniprot_ids),
+            'Uniprot_ID': uniprot_ids, 'Protein names': np.char.add('Synthetic protein ', gene_names),
+            'Gene names': [f'G{uniprot_ids[i]} {gene_names[i]}' for i in range(proteins)],
+            'Length': offsets[1:] - offsets[:-1]}, columns=PROTEOME_COLUMNS),
+        '1_References': pd.DataFrame([[source, f'Synthetic reference {source}', f'https://doi.org/10.0/{source}',
+                                       'synthetic'] for source in SOURCES], columns=SOURCES_COLUMNS),
+    }
+    sites = 0
+    for row in modifications_df.itertuples():
+        if row.Code == "multiple":
+            continue
+        sheets[row.Sheet] = _get_modification_sheet(rng, residues, offsets, uniprot_ids, gene_names,
+                                                    row.Amino_acids, site_density)
+        sites += len(sheets[row.Sheet])
+    parameters['sites'] = sites
+
+    print(f'Writing workbook with {sites} sites', file=stderr)
+    _write_workbook(os.path.join(directory, PATHS['excel_path']), sheets)
+
+    with open(os.path.join(directory, PARAMETERS_FILE), 'w') as f:
+        json.dump(parameters, f, indent=1)
+    return parameters
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("directory")
+    parser.add_argument("--proteins", type=int, default=1000)
+    parser.add_argument("--site-density", dest="site_density", type=float, default=0.01,
+                        help="probability that an allowed residue has a site of each modification type")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backbone", action="store_true", help="write backbone atoms instead of CA atoms only")
+    args = parser.parse_args()
+    generate(args.directory, args.proteins, args.site_density, args.seed, backbone=args.backbone)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,8 @@ This file contains code from GLmol modified by y-mtPTM authors.
 
 
 var glmol01 = new GLmol('glmol01', true);
+// representation exported from PyMOL, fetched together with the structure
+var glmol01Representation = '';
 
 addTab('#glmol01_viewbox', '450px', 1);
 addTab('#glmol01_infobox', '400px', 2);
@@ -49,7 +51,7 @@ function defineRep() {
 
   var repMode = $('input[name=glmol01_useImported]:checked').val();
   if (repMode == 'true') {
-     this.parseRep(this.modelGroup, $('#glmol01_rep').val());
+     this.parseRep(this.modelGroup, glmol01Representation);
   } else {
      var all = this.getAllAtoms();
      var allHet = this.getHetatms(all);
@@ -170,6 +172,9 @@ glmol01.parseSS = function(str, ss) {
 };
 
 function parseRep(parentgroup, str) { // TODO: implement!
+   // representations of the compact format are JSON objects
+   if (str.charAt(0) == '{') return this.parseCompactRep(parentgroup, JSON.parse(str));
+
    var lines = str.split("\n");
    var group = new THREE.Object3D();
    var rgroup = new THREE.Object3D();
@@ -272,7 +277,35 @@ glmol01.rebuildScene = function(repressDraw) {
 
 glmol01.parseRep = parseRep;
 glmol01.defineRepresentation = defineRep;
-glmol01.loadMolecule(true);
-$('#loading').hide();
+function loadStructure() {
+   var viewer = $('#glmol01');
+   $.when($.get(viewer.data('pdb'), null, null, 'text'), $.get(viewer.data('representation'), null, null, 'text'))
+   .done(function(pdb, representation) {
+      glmol01Representation = representation[0];
+      glmol01.loadMoleculeStr(true, pdb[0]);
+      $('#loading').hide();
+   })
+   .fail(function() {
+      $('#loading').html('<p>The structure could not be loaded from server.</p>');
+   });
+}
+
+// the structure is fetched only when the viewer is scrolled into view
+if (document.getElementById('viewer') == null) {
+   // page of a protein without structure
+} else if ('IntersectionObserver' in window) {
+   var structureObserver = new IntersectionObserver(function(entries) {
+      for (var i = 0; i < entries.length; i++) {
+         if (entries[i].isIntersecting) {
+            structureObserver.disconnect();
+            loadStructure();
+            return;
+         }
+      }
+   }, {rootMargin: '200px'});
+   structureObserver.observe(document.getElementById('viewer'));
+} else {
+   loadStructure();
+}
 
 
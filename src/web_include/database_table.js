@@ -0,0 +1,142 @@
+/*
+Table of proteins on database.html rendered from database.json written by html_builder.py.
+Only the rows visible in the scrolled container are in the document. Rows with a nonzero
+count of each modification are precomputed as bitsets, so filtering needs no parsing
+of table cells, and orders of sorted columns are computed once and kept.
+*/
+
+var proteinTable = null;
+// bitsets of rows with a nonzero count of each modification, by modification code
+var modificationRows = {};
+// row indices in the order of each sorted column, by column index
+var columnOrders = {};
+// shown rows: indices of proteins in the current order passing the current filter
+var shownRows = null;
+var currentFilter = '';
+var currentOrder = null;
+var rowHeight = 0;
+// number of rows rendered above and below the visible rows
+var overscanRows = 10;
+
+function getRowBitset(counts) {
+   var bitset = new Uint32Array((counts.length + 31) >> 5);
+   for (var i = 0; i < counts.length; i++) {
+      if (counts[i] > 0) bitset[i >> 5] |= 1 << (i & 31);
+   }
+   return bitset;
+}
+
+function getColumnOrder(column) {
+   if (!(column in columnOrders)) {
+      var proteins = proteinTable.proteins;
+      var order = new Int32Array(proteins.length);
+      for (var i = 0; i < order.length; i++) order[i] = i;
+      var collator = new Intl.Collator(undefined, {numeric: true, sensitivity: 'base'});
+      order.sort(function(a, b) {
+         var x = proteins[a][column], y = proteins[b][column];
+         if (typeof x == 'number') return (x - y) || (a - b);
+         return collator.compare(String(x), String(y)) || (a - b);
+      });
+      columnOrders[column] = order;
+   }
+   return columnOrders[column];
+}
+
+function updateShownRows() {
+   var count = proteinTable.proteins.length;
+   var order = (currentOrder == null) ? null : getColumnOrder(currentOrder.column);
+   var bitset = currentFilter ? modificationRows[currentFilter] : null;
+   var rows = new Int32Array(count);
+   var n = 0;
+   for (var i = 0; i < count; i++) {
+      var row = (order == null) ? i : (currentOrder.descending ? order[count - 1 - i] : order[i]);
+      if (bitset == null || (bitset[row >> 5] >>> (row & 31)) & 1) rows[n++] = row;
+   }
+   shownRows = rows.subarray(0, n);
+   $('#table_status').text('Shown proteins: ' + n + ' of ' + count);
+   $('#table_scroll').scrollTop(0);
+   renderRows();
+}
+
+function getRow(row) {
+   var protein = proteinTable.proteins[row];
+   var tr = $('<tr>');
+   var link = protein[0] + '.html';
+   $('<td>').append($('<a class="text-dark">').attr('href', link).text(protein[0])).appendTo(tr);
+   for (var j = 1; j < protein.length; j++) {
+      $('<td style="white-space: nowrap; overflow: hidden; text-overflow: ellipsis;">')
+         .attr('title', protein[j]).text(protein[j]).appendTo(tr);
+   }
+   for (var m = 0; m < proteinTable.modifications.length; m++) {
+      $('<td>').append($('<a class="text-dark">').attr('href', link)
+         .text(proteinTable.counts[m][row])).appendTo(tr);
+   }
+   return tr;
+}
+
+function renderRows() {
+   if (shownRows == null) return;
+   var body = $('#prot').empty();
+   var container = $('#table_scroll');
+   if (rowHeight == 0 && shownRows.length > 0) {
+      // measure the height of one row
+      body.append(getRow(shownRows[0]));
+      rowHeight = body.children().first().outerHeight() || 30;
+      body.empty();
+   }
+   var headerHeight = container.find('thead').outerHeight() || 0;
+   var first = Math.max(0, Math.floor((container.scrollTop() - headerHeight) / rowHeight) - overscanRows);
+   var last = Math.min(shownRows.length,
+                       Math.ceil((container.scrollTop() + container.height()) / rowHeight) + overscanRows);
+   body.append(getSpacerRow(first * rowHeight));
+   for (var i = first; i < last; i++) body.append(getRow(shownRows[i]));
+   body.append(getSpacerRow((shownRows.length - last) * rowHeight));
+}
+
+function getSpacerRow(height) {
+   // empty row taking the place of rows which are not rendered
+   var columns = 5 + proteinTable.modifications.length;
+   return $('<tr>').append($('<td style="padding: 0; border: 0;">').attr('colspan', columns).css('height', height + 'px'));
+}
+
+function filterTable(code) {
+   // show only rows with a nonzero count of modification code, all rows for ''
+   currentFilter = code;
+   if (proteinTable != null) updateShownRows();
+}
+
+function sortTable(column) {
+   // sort rows by a column of proteins, repeated click reverses the order
+   if (currentOrder != null && currentOrder.column == column) {
+      currentOrder.descending = !currentOrder.descending;
+   } else {
+      currentOrder = {column: column, descending: false};
+   }
+   if (proteinTable != null) updateShownRows();
+}
+
+function checkRadio(radioButtonId) {
+   // check radiobutton with a given id (starts with #)
+   $(radioButtonId).last().prop('checked', true);
+}
+
+$(document).ready(function() {
+   var scheduled = false;
+   $('#table_scroll').on('scroll', function() {
+      if (scheduled) return;
+      scheduled = true;
+      window.requestAnimationFrame(function() {
+         scheduled = false;
+         renderRows();
+      });
+   });
+   $.getJSON('database.json').done(function(table) {
+      proteinTable = table;
+      for (var m = 0; m < table.modifications.length; m++) {
+         modificationRows[table.modifications[m]] = getRowBitset(table.counts[m]);
+      }
+      updateShownRows();
+   }).fail(function() {
+      $('#table_status').text('The table of proteins could not be loaded.');
+   });
+});
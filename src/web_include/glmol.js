@@ -1495,6 +1495,102 @@ GLmol.prototype.defineRepresentation = function() {
    this.drawCartoon(this.modelGroup, all, this.curveWidth);
 };
 
+// Expands delta encoded ranges [gap0, length0, gap1, length1, ...] of the compact
+// representation format to a list of atom serials. Each gap is measured from the end
+// of the previous range.
+GLmol.prototype.expandRanges = function(ranges) {
+   var ret = [];
+   var pos = 0;
+   for (var i = 0, lim = ranges.length - 1; i < lim; i += 2) {
+      pos += ranges[i];
+      for (var j = 0; j < ranges[i + 1]; j++) ret.push(pos + j);
+      pos += ranges[i + 1];
+   }
+   return ret;
+};
+
+GLmol.prototype.setSSRanges = function(ranges, ss) {
+   var atoms = this.atoms;
+   var pos = 0;
+   for (var i = 0, lim = ranges.length - 1; i < lim; i += 2) {
+      var start = pos + ranges[i], end = start + ranges[i + 1] - 1;
+      for (var j = start; j <= end; j++) {
+         if (atoms[j]) atoms[j].ss = ss;
+      }
+      if (atoms[start]) atoms[start].ssbegin = true;
+      if (atoms[end]) atoms[end].ssend = true;
+      pos = end + 1;
+   }
+};
+
+// Parses the compact representation exported by pymol2glmol.get_rep(compact=True),
+// an object with keys reps, helix, sheet, colors, dists, view and bgcolor.
+GLmol.prototype.parseCompactRep = function(parentgroup, rep) {
+   var group = new THREE.Object3D();
+   var rgroup = new THREE.Object3D();
+   rgroup.add(group);
+   parentgroup.add(rgroup);
+
+   // 1st pass; colors, secondary structure, dists and view
+   for (var i = 0; i < rep.colors.length; i++) {
+      this.colorAtoms(this.expandRanges(rep.colors[i][1]), rep.colors[i][0]);
+   }
+   this.setSSRanges(rep.helix, 'h');
+   this.setSSRanges(rep.sheet, 's');
+   for (var i = 0; i < rep.dists.length; i++) {
+      var c = rep.dists[i][0], points = rep.dists[i][1];
+      var color = new THREE.Color();
+      color.r = c[0]; color.g = c[1]; color.b = c[2];
+      var out = [];
+      for (var j = 0, jlim = Math.floor(points.length / 3); j < jlim; j++) {
+         out.push(new THREE.Vector3(points[3 * j], points[3 * j + 1], points[3 * j + 2]));
+      }
+      this.drawDottedLines(group, out, color);
+   }
+   var view = rep.view;
+   if (view && view.length >= 17) {
+      rgroup.matrixAutoUpdate = false;
+      rgroup.matrix.n11 = view[8];
+      rgroup.matrix.n21 = view[9];
+      rgroup.matrix.n31 = view[10];
+      rgroup.matrix.n12 = view[11];
+      rgroup.matrix.n22 = view[12];
+      rgroup.matrix.n32 = view[13];
+      rgroup.matrix.n13 = view[14];
+      rgroup.matrix.n23 = view[15];
+      rgroup.matrix.n33 = view[16];
+      group.position.x = view[0]; group.position.y = view[1]; group.position.z = view[2];
+      this.rotationGroup.position.z = view[3];
+      this.slabNear = view[4]; this.slabFar = view[5];
+      this.fogStart = view[6]; this.fov = view[7];
+   }
+   if (rep.bgcolor != undefined) this.setBackground(rep.bgcolor);
+
+   // 2nd pass; representations
+   var reps = rep.reps;
+   for (var type in reps) {
+      var atoms = this.expandRanges(reps[type]);
+      if (atoms.length == 0) continue;
+      if (type == 'sphere') {
+         this.drawAtomsAsSphere(group, atoms);
+      } else if (type == 'stick') {
+         this.drawBondsAsStick(group, atoms, this.cylinderRadius, this.cylinderRadius, true);
+      } else if (type == 'ribbon') {
+         this.drawCartoon(group, atoms, this.curveWidth);
+         this.drawCartoonNucleicAcid(group, atoms);
+      } else if (type == 'trace') {
+         this.drawMainchainCurve(group, atoms, this.curveWidth, 'CA', 1);
+         this.drawMainchainCurve(group, atoms, this.curveWidth, 'O3\'', 1);
+      } else if (type == 'line') {
+         this.drawBondsAsLine(group, atoms, this.lineWidth * 2);
+      } else if (type == 'cross') {
+         this.drawAsCross(group, atoms, 0.3);
+      } else if (type == 'smallSphere') {
+         this.drawAtomsAsSphere(group, atoms, 0.3, true);
+      }
+   }
+};
+
 GLmol.prototype.getView = function() {
    if (!this.modelGroup) return [0, 0, 0, 0, 0, 0, 0, 1];
    var pos = this.modelGroup.position;
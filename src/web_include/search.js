@@ -0,0 +1,87 @@
+/*
+Search of proteins in the search index written by html_builder.py (search_index.json).
+Each word of the query must be a prefix of a word of the protein; words are found
+by binary search in the sorted list of words of the index.
+*/
+
+var searchIndex = null;
+// maximum number of shown results
+var maxSearchResults = 20;
+
+function getWords(text) {
+   return text.toLowerCase().match(/[\p{L}\p{N}]+/gu) || [];
+}
+
+// index of the first word of the index which is not smaller than word
+function lowerBound(words, word) {
+   var lo = 0, hi = words.length;
+   while (lo < hi) {
+      var mid = (lo + hi) >> 1;
+      if (words[mid] < word) lo = mid + 1; else hi = mid;
+   }
+   return lo;
+}
+
+// returns indices of matching proteins, proteins with more exactly matching words first
+function searchProteins(query) {
+   var queryWords = getWords(query);
+   if (searchIndex == null || queryWords.length == 0) return [];
+   var words = searchIndex.words;
+   var scores = null;
+   for (var i = 0; i < queryWords.length; i++) {
+      // proteins containing a word starting with queryWords[i], 1 for prefix and 2 for exact match
+      var matches = new Map();
+      for (var j = lowerBound(words, queryWords[i]); j < words.length && words[j].startsWith(queryWords[i]); j++) {
+         var exact = (words[j] == queryWords[i]) ? 2 : 1;
+         var postings = searchIndex.postings[j];
+         for (var k = 0; k < postings.length; k++) {
+            if (scores == null || scores.has(postings[k])) {
+               matches.set(postings[k], Math.max(matches.get(postings[k]) || 0, exact));
+            }
+         }
+      }
+      if (scores != null) {
+         matches.forEach(function(score, protein) { matches.set(protein, score + scores.get(protein)); });
+      }
+      scores = matches;
+      if (scores.size == 0) break;
+   }
+   return Array.from(scores.keys()).sort(function(a, b) {
+      return (scores.get(b) - scores.get(a)) || (a - b);
+   });
+}
+
+function showSearchResults() {
+   var results = searchProteins($('#search_input').val());
+   var list = $('#search_results').empty();
+   for (var i = 0; i < Math.min(results.length, maxSearchResults); i++) {
+      var protein = searchIndex.proteins[results[i]];
+      $('<a class="list-group-item list-group-item-action">')
+         .attr('href', protein[0] + '.html')
+         .text(protein[1])
+         .appendTo(list);
+   }
+   if (results.length > maxSearchResults) {
+      $('<div class="list-group-item small">')
+         .text('... and ' + (results.length - maxSearchResults) + ' more proteins')
+         .appendTo(list);
+   }
+}
+
+function goToProperPage() {
+   var first = $('#search_results a').first();
+   if (first.length) window.location.href = first.attr('href');
+}
+
+$(document).ready(function() {
+   $('#search_input').on('input', showSearchResults).on('keydown', function(event) {
+      if (event.key == 'Enter') goToProperPage();
+   });
+   $.getJSON('search_index.json').done(function(index) {
+      searchIndex = index;
+      $('#search_input').attr('placeholder', 'Search for a protein...');
+      showSearchResults();
+   }).fail(function() {
+      $('#search_input').attr('placeholder', 'The search index could not be loaded');
+   });
+});